@@ -3,11 +3,9 @@ Punto de entrada principal de la aplicación.
 Inicializa la base de datos y lanza la interfaz gráfica.
 """
 import sys
-from pathlib import Path
-
-# Agregar el directorio raíz al path para imports
-sys.path.insert(0, str(Path(__file__).parent))
 
+# Al ejecutar "python main.py" el directorio del script ya es sys.path[0],
+# así que el paquete src se importa sin modificar sys.path
 from src.ui_login import iniciar_aplicacion
 
 
@@ -0,0 +1,17 @@
+"""
+Patrones de validación compartidos.
+Se compilan una sola vez al importar el módulo, sin depender de la caché
+interna de re ni del orden en que se importen los demás módulos.
+"""
+import re
+
+
+# El email se valida por partes (local@host.tld): cada patrón es una sola
+# clase de caracteres sobre un trozo ya separado, así que fullmatch lo
+# recorre una vez sin backtracking (tiempo lineal como un DFA).
+LOCAL = re.compile(r'[A-Za-z0-9._%+\-]+')
+HOST = re.compile(r'[A-Za-z0-9.\-]+')
+
+# Conjuntos de bytes para revisar la contraseña en una sola pasada en C
+UPPER = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+PASSWORD_SPECIAL = frozenset(b'!@#$%^&*()_+-=[]{};:\'",.<>?/\\|`~')
@@ -3,13 +3,140 @@ Módulo de servicios de autenticación.
 Contiene toda la lógica de negocio para autenticación y validaciones.
 NO depende de la interfaz gráfica - diseñado para ser testeable.
 """
-import re
 import secrets
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import Tuple, Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Tuple, Optional
 from src.database import Database
+from src import _patterns
+
+
+# Bits de los requisitos de contraseña que se revisan por conjuntos de bytes
+_BIT_MAYUSCULA = 1
+_BIT_ESPECIAL = 2
+_REQUISITOS_PASSWORD = _BIT_MAYUSCULA | _BIT_ESPECIAL
+
+# Largo máximo de una dirección en el camino SMTP (RFC 5321, 4.5.3.1.3)
+_EMAIL_MAX = 254
+
+
+# Mensaje RFC 5322 ya armado: solo se rellenan remitente, destinatario y token.
+# El asunto va codificado (RFC 2047) porque los encabezados deben ser ASCII.
+_RECOVERY_TEMPLATE = (
+    "From: {frm}\r\n"
+    "To: {to}\r\n"
+    "Subject: =?utf-8?q?Recuperaci=C3=B3n_de_Contrase=C3=B1a?=\r\n"
+    "MIME-Version: 1.0\r\n"
+    "Content-Type: text/plain; charset=utf-8\r\n"
+    "Content-Transfer-Encoding: 8bit\r\n"
+    "\r\n"
+    "Hola,\r\n"
+    "\r\n"
+    "Has solicitado recuperar tu contraseña.\r\n"
+    "\r\n"
+    "Tu token de recuperación es: {token}\r\n"
+    "\r\n"
+    "Usa este token para restablecer tu contraseña.\r\n"
+    "\r\n"
+    "Si no solicitaste esto, ignora este mensaje.\r\n"
+    "\r\n"
+    "Saludos,\r\n"
+    "Sistema de Autenticación\r\n"
+)
+
+
+class _SmtpPool:
+    """
+    Mantiene abiertas las conexiones SMTP ya autenticadas para reutilizarlas.
+    
+    Se guarda una conexión por (servidor, puerto, usuario); el handshake
+    TCP + STARTTLS + AUTH solo se paga al abrirla o tras estar inactiva.
+    """
+    
+    # Segundos sin uso tras los cuales la conexión se cierra y se reabre
+    _INACTIVIDAD_MAX = 60.0
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conexiones: Dict[Tuple[str, int, str], Tuple[smtplib.SMTP, float]] = {}
+    
+    def send(self, destinatario: str, mensaje: bytes, smtp_server: str,
+             smtp_port: int, smtp_user: str, smtp_password: str):
+        """
+        Envía un mensaje reutilizando (o abriendo) la conexión del remitente.
+        
+        Args:
+            destinatario: Dirección de destino
+            mensaje: Mensaje RFC 5322 ya codificado
+            smtp_server: Servidor SMTP
+            smtp_port: Puerto SMTP
+            smtp_user: Usuario SMTP
+            smtp_password: Contraseña SMTP
+        """
+        clave = (smtp_server, smtp_port, smtp_user)
+        with self._lock:
+            server = self._obtener(clave, smtp_password)
+            try:
+                server.sendmail(smtp_user, [destinatario], mensaje)
+            except smtplib.SMTPServerDisconnected:
+                # El servidor cerró la conexión por su cuenta: reintentar una vez
+                self._descartar(clave)
+                server = self._obtener(clave, smtp_password)
+                server.sendmail(smtp_user, [destinatario], mensaje)
+            self._conexiones[clave] = (server, time.monotonic())
+    
+    def _obtener(self, clave: Tuple[str, int, str], smtp_password: str) -> smtplib.SMTP:
+        """Retorna la conexión vigente para la clave o abre una nueva."""
+        entrada = self._conexiones.get(clave)
+        if entrada is not None:
+            if time.monotonic() - entrada[1] < self._INACTIVIDAD_MAX:
+                return entrada[0]
+            self._descartar(clave)
+        
+        smtp_server, smtp_port, smtp_user = clave
+        server = smtplib.SMTP(smtp_server, smtp_port)
+        try:
+            server.starttls()
+            server.login(smtp_user, smtp_password)
+        except Exception:
+            server.close()
+            raise
+        self._conexiones[clave] = (server, time.monotonic())
+        return server
+    
+    def _descartar(self, clave: Tuple[str, int, str]):
+        """Cierra y olvida la conexión asociada a la clave."""
+        entrada = self._conexiones.pop(clave, None)
+        if entrada is None:
+            return
+        try:
+            entrada[0].quit()
+        except Exception:
+            entrada[0].close()
+    
+    def cerrar(self):
+        """Cierra todas las conexiones abiertas."""
+        with self._lock:
+            for clave in list(self._conexiones):
+                self._descartar(clave)
+
+
+_smtp_pool = _SmtpPool()
+
+
+def _normalizar_email(email: Optional[str]) -> str:
+    """
+    Recorta los espacios del email una sola vez, a la entrada del servicio.
+    
+    Args:
+        email: Email tal como lo escribió el usuario (puede ser None)
+        
+    Returns:
+        Email sin espacios alrededor, o '' si viene vacío
+    """
+    return email.strip() if email else ''
 
 
 class AuthService:
@@ -24,6 +151,8 @@ class AuthService:
         """
         self.db = db
         self.max_intentos = 5
+        # El envío SMTP es I/O lento: se hace fuera del hilo que llama (UI)
+        self._smtp_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="smtp")
     
     @staticmethod
     def validar_email(email: str) -> Tuple[bool, str]:
@@ -36,13 +165,31 @@ class AuthService:
         Returns:
             Tupla (es_válido: bool, mensaje: str)
         """
-        if not email or len(email.strip()) == 0:
+        # isspace() revisa sin crear una copia recortada del string
+        if not email or email.isspace():
             return False, "El email no puede estar vacío"
         
-        # Patrón regex para validar email
-        patron = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+        # Una dirección más larga no es entregable: se rechaza sin recorrerla
+        if len(email) > _EMAIL_MAX:
+            return False, "Formato de email inválido"
+        
+        # Separar en la última @ antes de usar regex (rechazo temprano)
+        arroba = email.rfind('@')
+        if arroba < 1:
+            return False, "Formato de email inválido"
+        
+        local = email[:arroba]
+        dominio = email[arroba + 1:]
+        punto = dominio.rfind('.')
+        if punto < 1:
+            return False, "Formato de email inválido"
         
-        if not re.match(patron, email):
+        # La extensión (tras el último punto) son 2+ letras ASCII
+        extension = dominio[punto + 1:]
+        if len(extension) < 2 or not extension.isascii() or not extension.isalpha():
+            return False, "Formato de email inválido"
+        
+        if not _patterns.LOCAL.fullmatch(local) or not _patterns.HOST.fullmatch(dominio, 0, punto):
             return False, "Formato de email inválido"
         
         return True, "Email válido"
@@ -71,13 +218,24 @@ class AuthService:
         if len(password) > 10:
             return False, "La contraseña no puede tener más de 10 caracteres"
         
-        if not any(c.isupper() for c in password):
-            return False, "La contraseña debe contener al menos una mayúscula"
+        pw_bytes = password.encode('utf-8', 'surrogatepass')
         
-        # Caracteres especiales comunes
-        caracteres_especiales = r'[!@#$%^&*()_+\-=\[\]{};:\'",.<>?/\\|`~]'
-        if not re.search(caracteres_especiales, password):
-            return False, "La contraseña debe contener al menos un carácter especial"
+        # Cada requisito cumplido enciende un bit; se decide con una sola
+        # comparación en el caso común (contraseña válida)
+        flags = (not _patterns.UPPER.isdisjoint(pw_bytes)) | (
+            (not _patterns.PASSWORD_SPECIAL.isdisjoint(pw_bytes)) << 1
+        )
+        if flags != _REQUISITOS_PASSWORD:
+            # Mayúsculas no ASCII (ej: 'Á') solo se revisan si hay bytes no ASCII
+            if not flags & _BIT_MAYUSCULA and not password.isascii():
+                flags |= any(c.isupper() for c in password)
+            
+            if not flags & _BIT_MAYUSCULA:
+                return False, "La contraseña debe contener al menos una mayúscula"
+            
+            # Caracteres especiales comunes
+            if not flags & _BIT_ESPECIAL:
+                return False, "La contraseña debe contener al menos un carácter especial"
         
         return True, "Contraseña válida"
     
@@ -92,6 +250,8 @@ class AuthService:
         Returns:
             Tupla (éxito: bool, mensaje: str)
         """
+        email = _normalizar_email(email)
+        
         # Validar email
         email_valido, mensaje_email = self.validar_email(email)
         if not email_valido:
@@ -105,6 +265,31 @@ class AuthService:
         # Crear usuario en la base de datos
         return self.db.crear_usuario(email, password)
     
+    def registrar_usuarios(self, usuarios: Iterable[Tuple[str, str]]) -> Tuple[bool, str]:
+        """
+        Registra varios usuarios a la vez después de validar todos los datos.
+        
+        Los usuarios se insertan en una sola transacción: si alguno no es
+        válido o ya existe, no se registra ninguno.
+        
+        Args:
+            usuarios: Pares (email, contraseña)
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str)
+        """
+        usuarios = [(_normalizar_email(email), password) for email, password in usuarios]
+        for email, password in usuarios:
+            email_valido, mensaje_email = self.validar_email(email)
+            if not email_valido:
+                return False, f"{email}: {mensaje_email}"
+            
+            password_valida, mensaje_password = self.validar_password(password)
+            if not password_valida:
+                return False, f"{email}: {mensaje_password}"
+        
+        return self.db.crear_usuarios(usuarios)
+    
     def iniciar_sesion(self, email: str, password: str) -> Tuple[bool, str]:
         """
         Intenta iniciar sesión con las credenciales proporcionadas.
@@ -116,15 +301,44 @@ class AuthService:
         Returns:
             Tupla (éxito: bool, mensaje: str)
         """
+        exito, mensaje, _, _ = self.iniciar_sesion_con_estado(email, password)
+        return exito, mensaje
+    
+    def iniciar_sesion_con_estado(self, email: str,
+                                  password: str) -> Tuple[bool, str, int, bool]:
+        """
+        Intenta iniciar sesión y retorna también el estado del usuario.
+        
+        Los intentos restantes y el bloqueo salen de la misma consulta que
+        verifica las credenciales. Una cuenta ya bloqueada se rechaza con esa
+        lectura de índice, sin bcrypt.
+        
+        Args:
+            email: Email del usuario
+            password: Contraseña del usuario
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str, intentos_restantes: int,
+            bloqueado: bool); intentos_restantes es 0 si el usuario no existe
+        """
         # Validar que los campos no estén vacíos
-        if not email or len(email.strip()) == 0:
-            return False, "El email no puede estar vacío"
+        email = _normalizar_email(email)
+        if not email:
+            return False, "El email no puede estar vacío", 0, False
         
-        if not password or len(password.strip()) == 0:
-            return False, "La contraseña no puede estar vacía"
+        if not password or password.isspace():
+            return False, "La contraseña no puede estar vacía", 0, False
         
         # Verificar credenciales en la base de datos
-        return self.db.verificar_credenciales(email, password)
+        exito, mensaje, estado = self.db.verificar_credenciales_con_estado(email, password)
+        if estado is None:
+            return exito, mensaje, 0, False
+        
+        bloqueado, intentos_usados = estado
+        if bloqueado:
+            return exito, mensaje, 0, True
+        
+        return exito, mensaje, max(0, self.max_intentos - intentos_usados), False
     
     def generar_token_recuperacion(self) -> str:
         """
@@ -139,7 +353,8 @@ class AuthService:
                                        smtp_server: str = None,
                                        smtp_port: int = 587,
                                        smtp_user: str = None,
-                                       smtp_password: str = None) -> Tuple[bool, str]:
+                                       smtp_password: str = None,
+                                       usuario: Optional[dict] = None) -> Tuple[bool, str]:
         """
         Solicita la recuperación de contraseña enviando un token por email.
         
@@ -149,12 +364,17 @@ class AuthService:
             smtp_port: Puerto SMTP
             smtp_user: Usuario SMTP
             smtp_password: Contraseña SMTP
+            usuario: Datos del usuario si quien llama ya los consultó
+                (evita volver a leerlos de la base de datos)
             
         Returns:
             Tupla (éxito: bool, mensaje: str)
         """
+        email = _normalizar_email(email)
+        
         # Validar que el usuario existe
-        usuario = self.db.obtener_usuario(email)
+        if usuario is None:
+            usuario = self.db.obtener_usuario(email)
         if not usuario:
             return False, "El email no está registrado"
         
@@ -168,21 +388,37 @@ class AuthService:
         
         # Enviar email (solo si se proporcionan credenciales SMTP)
         if smtp_server and smtp_user and smtp_password:
-            try:
-                exito_email = self._enviar_email_recuperacion(
-                    email, token, smtp_server, smtp_port, smtp_user, smtp_password
-                )
-                if exito_email:
-                    return True, f"Email de recuperación enviado a {email}"
-                else:
-                    return True, f"Token generado (email no enviado): {token}"
-            except Exception as e:
-                # Aunque el email falle, el token se guardó
-                return True, f"Token generado pero email falló: {token}"
+            # El token ya se guardó; el email se envía en segundo plano y el
+            # resultado solo se registra, sin bloquear a quien llama
+            futuro = self._smtp_executor.submit(
+                self._enviar_email_recuperacion,
+                email, token, smtp_server, smtp_port, smtp_user, smtp_password
+            )
+            futuro.add_done_callback(
+                lambda f: self._registrar_envio(email, f)
+            )
+            return True, "Token generado, email en proceso"
         else:
             # Modo de desarrollo - retornar el token directamente
             return True, f"Token de recuperación generado: {token}"
     
+    @staticmethod
+    def _registrar_envio(destinatario: str, futuro: Future):
+        """
+        Registra el resultado de un envío de recuperación en segundo plano.
+        
+        Args:
+            destinatario: Email del usuario
+            futuro: Futuro retornado por el executor SMTP
+        """
+        try:
+            enviado = futuro.result()
+        except Exception as e:
+            enviado = False
+            print(f"Error al enviar email: {e}")
+        if not enviado:
+            print(f"Email de recuperación no enviado a {destinatario}")
+    
     def _enviar_email_recuperacion(self, destinatario: str, token: str,
                                    smtp_server: str, smtp_port: int,
                                    smtp_user: str, smtp_password: str) -> bool:
@@ -201,33 +437,14 @@ class AuthService:
             True si el email se envió correctamente
         """
         try:
-            mensaje = MIMEMultipart()
-            mensaje['From'] = smtp_user
-            mensaje['To'] = destinatario
-            mensaje['Subject'] = 'Recuperación de Contraseña'
-            
-            cuerpo = f"""
-            Hola,
-            
-            Has solicitado recuperar tu contraseña.
-            
-            Tu token de recuperación es: {token}
-            
-            Usa este token para restablecer tu contraseña.
-            
-            Si no solicitaste esto, ignora este mensaje.
+            mensaje = _RECOVERY_TEMPLATE.format_map(
+                {'frm': smtp_user, 'to': destinatario, 'token': token}
+            ).encode('utf-8')
             
-            Saludos,
-            Sistema de Autenticación
-            """
-            
-            mensaje.attach(MIMEText(cuerpo, 'plain'))
-            
-            # Conectar y enviar
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                server.login(smtp_user, smtp_password)
-                server.send_message(mensaje)
+            # Enviar reutilizando la conexión autenticada si ya existe
+            _smtp_pool.send(
+                destinatario, mensaje, smtp_server, smtp_port, smtp_user, smtp_password
+            )
             
             return True
             
@@ -235,12 +452,14 @@ class AuthService:
             print(f"Error al enviar email: {e}")
             return False
     
-    def cambiar_password(self, email: str, nueva_password: str) -> Tuple[bool, str]:
+    def cambiar_password(self, email: str, token: str,
+                         nueva_password: str) -> Tuple[bool, str]:
         """
-        Cambia la contraseña de un usuario.
+        Cambia la contraseña de un usuario que presenta su token de recuperación.
         
         Args:
             email: Email del usuario
+            token: Token entregado por solicitar_recuperacion_password
             nueva_password: Nueva contraseña
             
         Returns:
@@ -251,8 +470,12 @@ class AuthService:
         if not password_valida:
             return False, mensaje
         
-        # Cambiar en la base de datos
-        return self.db.cambiar_password(email, nueva_password)
+        if not token:
+            return False, "Token inválido o expirado"
+        
+        # Cambiar en la base de datos (también desbloquea al usuario)
+        email = _normalizar_email(email)
+        return self.db.cambiar_password_con_token(email, token, nueva_password)
     
     def obtener_intentos_restantes(self, email: str) -> int:
         """
@@ -264,14 +487,14 @@ class AuthService:
         Returns:
             Número de intentos restantes (0 si está bloqueado o no existe)
         """
-        usuario = self.db.obtener_usuario(email)
-        if not usuario:
+        estado = self.db.obtener_estado_usuario(_normalizar_email(email))
+        if estado is None:
             return 0
         
-        if usuario['bloqueado'] == 1:
+        bloqueado, intentos_usados = estado
+        if bloqueado:
             return 0
         
-        intentos_usados = usuario['intentos_fallidos']
         return max(0, self.max_intentos - intentos_usados)
     
     def usuario_esta_bloqueado(self, email: str) -> bool:
@@ -284,8 +507,8 @@ class AuthService:
         Returns:
             True si el usuario está bloqueado
         """
-        usuario = self.db.obtener_usuario(email)
-        if not usuario:
+        estado = self.db.obtener_estado_usuario(_normalizar_email(email))
+        if estado is None:
             return False
         
-        return usuario['bloqueado'] == 1
+        return estado.bloqueado
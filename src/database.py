@@ -4,76 +4,460 @@ Maneja la conexión, creación de tablas y operaciones CRUD para usuarios.
 """
 import sqlite3
 import hashlib
+import hmac
+import json
+import math
 import os
-from datetime import datetime
-from typing import Optional, Tuple
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Set, Tuple
+
+import bcrypt
+
+
+# Sentencias SQL como constantes: el mismo texto en cada llamada (sin
+# f-strings) aprovecha la caché de sentencias preparadas de sqlite3
+# email UNIQUE ya crea el índice sqlite_autoindex_usuarios_1: las búsquedas
+# por email son O(log n) y el duplicado se detecta en el propio INSERT
+_SQL_CREAR_TABLA_USUARIOS = """
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        fecha_creacion TEXT NOT NULL,
+        intentos_fallidos INTEGER DEFAULT 0,
+        bloqueado INTEGER DEFAULT 0,
+        ultimo_intento TEXT
+    )
+"""
+
+# fecha_creacion de los tokens va en UTC: su vigencia no depende de la zona horaria
+_SQL_CREAR_TABLA_TOKENS = """
+    CREATE TABLE IF NOT EXISTS recovery_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL,
+        token TEXT NOT NULL,
+        fecha_creacion TEXT NOT NULL,
+        usado INTEGER DEFAULT 0,
+        FOREIGN KEY (email) REFERENCES usuarios(email)
+    )
+"""
+
+# Índice que cubre la verificación de credenciales: la consulta se resuelve
+# solo con el índice, sin leer la fila de la tabla
+_SQL_CREAR_INDICE_VERIFICACION = """
+    CREATE INDEX IF NOT EXISTS idx_usuarios_verify
+    ON usuarios (email, password_hash, intentos_fallidos, bloqueado)
+"""
+
+_SQL_INSERTAR_USUARIO = """
+    INSERT INTO usuarios (email, password_hash, fecha_creacion)
+    VALUES (?, ?, ?)
+"""
+
+# Los contadores se actualizan relativos al valor guardado (atómico aunque
+# dos logins fallen a la vez); un usuario ya bloqueado no se modifica
+_SQL_REGISTRAR_FALLO = """
+    UPDATE usuarios
+    SET intentos_fallidos = intentos_fallidos + 1,
+        bloqueado = CASE WHEN intentos_fallidos + 1 >= 5 THEN 1 ELSE 0 END,
+        ultimo_intento = ?
+    WHERE email = ? AND bloqueado = 0
+    RETURNING intentos_fallidos, bloqueado
+"""
+
+_SQL_REGISTRAR_EXITO = """
+    UPDATE usuarios
+    SET intentos_fallidos = 0, ultimo_intento = ?
+    WHERE email = ? AND bloqueado = 0
+"""
+
+# Hashes SHA-256 sin sal anteriores a bcrypt (los de bcrypt empiezan con "$2")
+_SQL_HASHES_HEREDADOS = """
+    SELECT id, password_hash
+    FROM usuarios
+    WHERE substr(password_hash, 1, 2) != '$2'
+"""
+
+_SQL_ENVOLVER_HASH = """
+    UPDATE usuarios
+    SET password_hash = ?
+    WHERE id = ?
+"""
+
+_SQL_ESTADO_CREDENCIALES = """
+    SELECT password_hash, intentos_fallidos, bloqueado
+    FROM usuarios INDEXED BY idx_usuarios_verify
+    WHERE email = ?
+"""
+
+_SQL_ESTADO_USUARIO = """
+    SELECT bloqueado, intentos_fallidos
+    FROM usuarios INDEXED BY idx_usuarios_verify
+    WHERE email = ?
+"""
+
+_SQL_BLOQUEAR_USUARIO = """
+    UPDATE usuarios
+    SET intentos_fallidos = ?, bloqueado = 1, ultimo_intento = ?
+    WHERE email = ?
+"""
+
+_SQL_GUARDAR_INTENTOS = """
+    UPDATE usuarios
+    SET intentos_fallidos = ?, ultimo_intento = ?
+    WHERE email = ?
+"""
+
+_SQL_OBTENER_USUARIO = """
+    SELECT id, email, fecha_creacion, intentos_fallidos, bloqueado
+    FROM usuarios
+    WHERE email = ?
+"""
+
+# La lista de emails llega como un único parámetro JSON: la sentencia es
+# siempre la misma y se reutiliza desde la caché de sentencias preparadas
+_SQL_USUARIOS_EXISTEN = """
+    SELECT email
+    FROM usuarios
+    WHERE email IN (SELECT value FROM json_each(?))
+"""
+
+# Índice para buscar el último token vigente de un email sin recorrer la tabla
+_SQL_CREAR_INDICE_TOKENS = """
+    CREATE INDEX IF NOT EXISTS idx_tokens_email
+    ON recovery_tokens (email, usado)
+"""
+
+_SQL_INSERTAR_TOKEN = """
+    INSERT INTO recovery_tokens (email, token, fecha_creacion)
+    VALUES (?, ?, ?)
+"""
+
+# Solo el token más reciente sin usar es válido: pedir otro anula los previos
+_SQL_ULTIMO_TOKEN = """
+    SELECT id, token, fecha_creacion
+    FROM recovery_tokens
+    WHERE email = ? AND usado = 0
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+# Marca el token como usado solo si sigue libre (un token sirve una única vez)
+_SQL_USAR_TOKEN = """
+    UPDATE recovery_tokens
+    SET usado = 1
+    WHERE id = ? AND usado = 0
+"""
+
+_SQL_ANULAR_TOKENS = """
+    UPDATE recovery_tokens
+    SET usado = 1
+    WHERE email = ? AND usado = 0
+"""
+
+_SQL_CAMBIAR_PASSWORD = """
+    UPDATE usuarios
+    SET password_hash = ?, intentos_fallidos = 0, bloqueado = 0
+    WHERE email = ?
+"""
+
+_SQL_DESBLOQUEAR_USUARIO = """
+    UPDATE usuarios
+    SET intentos_fallidos = 0, bloqueado = 0
+    WHERE email = ?
+"""
+
+
+# bcrypt se calibra para tardar al menos _BCRYPT_OBJETIVO segundos por hash
+# (cada ronda adicional duplica el costo); el máximo acota máquinas lentas
+_BCRYPT_OBJETIVO = 0.25
+_BCRYPT_RONDAS_MIN = 4
+_BCRYPT_RONDAS_MAX = 16
+_BCRYPT_RONDAS_MUESTRA = 8
+
+
+def _prehash(password: str) -> bytes:
+    """
+    Retorna el SHA-256 en hexadecimal de la contraseña, como bytes.
+    
+    bcrypt solo usa los primeros 72 bytes y no admite bytes nulos; los 64
+    caracteres hexadecimales cumplen ambas cosas para cualquier contraseña.
+    Coincide además con el hash sin sal de versiones anteriores.
+    """
+    return hashlib.sha256(password.encode()).hexdigest().encode()
+
+
+@lru_cache(maxsize=None)
+def _calibrar_rondas_bcrypt() -> int:
+    """
+    Estima las rondas de bcrypt que alcanzan _BCRYPT_OBJETIVO en esta máquina.
+    
+    Se mide una sola vez por proceso con _BCRYPT_RONDAS_MUESTRA rondas (una
+    muestra lo bastante larga para que el reloj no la distorsione).
+    
+    Returns:
+        Número de rondas entre _BCRYPT_RONDAS_MIN y _BCRYPT_RONDAS_MAX
+    """
+    salt = bcrypt.gensalt(rounds=_BCRYPT_RONDAS_MUESTRA)
+    inicio = time.perf_counter()
+    bcrypt.hashpw(_prehash("calibracion"), salt)
+    duracion = max(time.perf_counter() - inicio, 1e-6)
+    
+    rondas = _BCRYPT_RONDAS_MUESTRA + math.ceil(math.log2(_BCRYPT_OBJETIVO / duracion))
+    return max(_BCRYPT_RONDAS_MIN, min(_BCRYPT_RONDAS_MAX, rondas))
+
+
+def _ahora_iso() -> str:
+    """
+    Retorna la fecha/hora local en formato ISO 8601 (precisión de segundos).
+    
+    time.strftime formatea en C, sin construir un objeto datetime por llamada.
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _ahora_utc_iso(desfase: float = 0.0) -> str:
+    """
+    Retorna la fecha/hora UTC en formato ISO 8601 ("...Z", precisión de segundos).
+    
+    Las vigencias se comparan en UTC: la hora local salta en los cambios de
+    horario de verano y un plazo de una hora podría durar dos o cero.
+    
+    Args:
+        desfase: Segundos a sumar al instante actual (negativo para el pasado)
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + desfase))
+
+
+class _CambioRechazado(Exception):
+    """Aborta (y deshace) la transacción de un cambio de contraseña."""
+
+
+class EstadoUsuario(NamedTuple):
+    """Estado de bloqueo de un usuario (se desempaqueta como una tupla)."""
+    bloqueado: bool
+    intentos_fallidos: int
 
 
 class Database:
     """Clase para manejar todas las operaciones de base de datos."""
     
-    def __init__(self, db_path: str = "data/auth_system.db"):
+    # Caché de lectura de usuarios (LRU con expiración)
+    _USER_TTL = 60.0
+    _USER_CACHE_MAX = 1024
+    
+    # Segundos entre escrituras diferidas de intentos fallidos
+    _FLUSH_INTERVALO = 2.0
+    
+    # Vigencia de un token de recuperación, en segundos
+    _TOKEN_VIGENCIA = 3600
+    
+    def __init__(self, db_path: str = "data/auth_system.db",
+                 diferir_intentos: bool = False,
+                 rondas_bcrypt: Optional[int] = None):
         """
         Inicializa la conexión a la base de datos.
         
         Args:
-            db_path: Ruta al archivo de base de datos SQLite
+            db_path: Ruta al archivo de base de datos SQLite, ":memory:" para
+                una base en memoria o una URI "file:..."
+            diferir_intentos: Si es True, los intentos fallidos se acumulan en
+                memoria y se escriben en lote cada _FLUSH_INTERVALO segundos.
+                El bloqueo y los logins exitosos se escriben siempre al instante.
+            rondas_bcrypt: Factor de costo de bcrypt (4-31). Si es None se
+                calibra para que cada hash tarde unos 250 ms en esta máquina.
         """
         self.db_path = db_path
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.diferir_intentos = diferir_intentos
+        self.rondas_bcrypt = (
+            rondas_bcrypt if rondas_bcrypt is not None else _calibrar_rondas_bcrypt()
+        )
+        # Hash de una contraseña que nadie conoce: un email inexistente paga
+        # el mismo bcrypt que uno existente y el tiempo no revela cuál es
+        self._hash_ficticio = self._hash_password(secrets.token_hex(16))
+        es_uri = db_path.startswith("file:")
+        # Crear directorio si no existe (no aplica a bases en memoria ni URIs)
+        directorio = os.path.dirname(db_path)
+        if directorio and not es_uri and db_path != ":memory:":
+            os.makedirs(directorio, exist_ok=True)
+        
+        # Una sola conexión (en modo autocommit) para toda la vida del objeto;
+        # el lock serializa su uso cuando se comparte entre hilos
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None,
+            cached_statements=256, uri=es_uri
+        )
+        self._conn.row_factory = sqlite3.Row  # Permite acceso por nombre de columna
+        
+        # email -> (instante de carga, datos del usuario)
+        self._user_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        
+        # email -> (intentos fallidos acumulados, último intento) pendientes de escribir
+        self._pending_attempts: Dict[str, Tuple[int, str]] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        
+        # WAL + synchronous=NORMAL: un solo fsync por checkpoint en lugar de
+        # uno por commit, manteniendo la base consistente ante caídas
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA mmap_size=134217728")
+        # Tablas temporales (ORDER BY, índices transitorios) en RAM y ~20 MB
+        # de caché de páginas en lugar de los ~2 MB por defecto
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        self._conn.execute("PRAGMA cache_size=-20000")
         self._create_tables()
     
     def _get_connection(self) -> sqlite3.Connection:
-        """Crea y retorna una conexión a la base de datos."""
-        conn = sqlite3.Connection(self.db_path)
-        conn.row_factory = sqlite3.Row  # Permite acceso por nombre de columna
-        return conn
+        """Retorna la conexión compartida a la base de datos."""
+        return self._conn
+    
+    def close(self):
+        """Cierra la conexión; con WAL el cierre hace el checkpoint final."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self._flush_intentos()
+            self._conn.close()
+    
+    def _programar_flush(self):
+        """Agenda una escritura en lote de intentos pendientes si no hay una."""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self._FLUSH_INTERVALO, self._flush_intentos)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _flush_intentos(self):
+        """Escribe en una sola transacción los intentos fallidos acumulados."""
+        with self._lock:
+            self._flush_timer = None
+            if not self._pending_attempts:
+                return
+            lote = [
+                (intentos, ultimo_intento, email)
+                for email, (intentos, ultimo_intento) in self._pending_attempts.items()
+            ]
+            self._pending_attempts.clear()
+            with self._transaccion() as cursor:
+                cursor.executemany(_SQL_GUARDAR_INTENTOS, lote)
+    
+    def _invalidar_usuario(self, email: str):
+        """Descarta la entrada en caché de un usuario tras modificarlo."""
+        with self._lock:
+            self._user_cache.pop(email, None)
+    
+    @contextmanager
+    def _transaccion(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Ejecuta un bloque de sentencias dentro de una transacción explícita.
+        
+        Confirma al salir del bloque y deshace si ocurre una excepción. Usa
+        un SAVEPOINT, que fuera de otra transacción equivale a BEGIN/COMMIT
+        y dentro de una (por ejemplo, la de un test) se anida sin error.
+        
+        Yields:
+            Cursor sobre la conexión compartida
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("SAVEPOINT transaccion")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK TO transaccion")
+                cursor.execute("RELEASE transaccion")
+                raise
+            cursor.execute("RELEASE transaccion")
+    
+    @contextmanager
+    def lote(self) -> Iterator[None]:
+        """
+        Agrupa varias operaciones en una sola transacción.
+        
+        Las escrituras de las llamadas hechas dentro del bloque se confirman
+        con un único commit al salir, o se deshacen todas si hay una excepción.
+        Mientras dura el bloque, otros hilos esperan a que termine.
+        """
+        try:
+            with self._transaccion():
+                yield
+        except BaseException:
+            # Lo leído dentro del bloque puede corresponder a filas deshechas
+            self._user_cache.clear()
+            raise
     
     def _create_tables(self):
         """Crea las tablas necesarias si no existen."""
         conn = self._get_connection()
         cursor = conn.cursor()
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                fecha_creacion TEXT NOT NULL,
-                intentos_fallidos INTEGER DEFAULT 0,
-                bloqueado INTEGER DEFAULT 0,
-                ultimo_intento TEXT
-            )
-        """)
+        cursor.execute(_SQL_CREAR_TABLA_USUARIOS)
+        
+        cursor.execute(_SQL_CREAR_INDICE_VERIFICACION)
         
         # Tabla para tokens de recuperación
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS recovery_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT NOT NULL,
-                token TEXT NOT NULL,
-                fecha_creacion TEXT NOT NULL,
-                usado INTEGER DEFAULT 0,
-                FOREIGN KEY (email) REFERENCES usuarios(email)
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
+        cursor.execute(_SQL_CREAR_TABLA_TOKENS)
+        cursor.execute(_SQL_CREAR_INDICE_TOKENS)
+        
+        self._envolver_hashes_heredados()
+    
+    def _envolver_hashes_heredados(self):
+        """
+        Envuelve en bcrypt los hashes SHA-256 sin sal de versiones anteriores.
+        
+        El hash heredado es exactamente _prehash(password), así que
+        bcrypt(hash_heredado) es el mismo hash que genera _hash_password y se
+        verifica igual, sin conocer la contraseña. Así ninguna cuenta, ni
+        siquiera una inactiva, conserva el SHA-256 sin sal en disco.
+        """
+        with self._lock:
+            filas = self._conn.execute(_SQL_HASHES_HEREDADOS).fetchall()
+        if not filas:
+            return
+        
+        lote = [
+            (bcrypt.hashpw(
+                fila['password_hash'].encode(), bcrypt.gensalt(rounds=self.rondas_bcrypt)
+            ).decode(), fila['id'])
+            for fila in filas
+        ]
+        with self._transaccion() as cursor:
+            cursor.executemany(_SQL_ENVOLVER_HASH, lote)
+    
+    def _hash_password(self, password: str) -> str:
+        """
+        Genera un hash bcrypt (con sal aleatoria) de la contraseña.
+        
+        Args:
+            password: Contraseña en texto plano
+            
+        Returns:
+            Hash en formato modular de bcrypt ("$2b$<rondas>$...", 60 caracteres)
+        """
+        # El SHA-256 previo corre en OpenSSL (con SHA-NI si la CPU lo tiene);
+        # el costo lo pone bcrypt
+        salt = bcrypt.gensalt(rounds=self.rondas_bcrypt)
+        return bcrypt.hashpw(_prehash(password), salt).decode()
     
     @staticmethod
-    def _hash_password(password: str) -> str:
+    def _verificar_password(password: str, password_hash: str) -> bool:
         """
-        Genera un hash SHA-256 de la contraseña.
+        Comprueba una contraseña contra el hash guardado.
         
         Args:
             password: Contraseña en texto plano
+            password_hash: Hash guardado en la base de datos
             
         Returns:
-            Hash hexadecimal de la contraseña
+            True si la contraseña corresponde al hash
         """
-        return hashlib.sha256(password.encode()).hexdigest()
+        return bcrypt.checkpw(_prehash(password), password_hash.encode())
     
     def crear_usuario(self, email: str, password: str) -> Tuple[bool, str]:
         """
@@ -87,19 +471,15 @@ class Database:
             Tupla (éxito: bool, mensaje: str)
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
             password_hash = self._hash_password(password)
-            fecha_actual = datetime.now().isoformat()
+            fecha_actual = _ahora_iso()
             
-            cursor.execute("""
-                INSERT INTO usuarios (email, password_hash, fecha_creacion)
-                VALUES (?, ?, ?)
-            """, (email, password_hash, fecha_actual))
+            with self._lock:
+                self._conn.execute(
+                    _SQL_INSERTAR_USUARIO, (email, password_hash, fecha_actual)
+                )
+                self._invalidar_usuario(email)
             
-            conn.commit()
-            conn.close()
             return True, "Usuario creado exitosamente"
             
         except sqlite3.IntegrityError:
@@ -107,6 +487,37 @@ class Database:
         except Exception as e:
             return False, f"Error al crear usuario: {str(e)}"
     
+    def crear_usuarios(self, usuarios: Iterable[Tuple[str, str]]) -> Tuple[bool, str]:
+        """
+        Crea varios usuarios en una sola transacción.
+        
+        Si algún email ya está registrado no se crea ninguno.
+        
+        Args:
+            usuarios: Pares (email, contraseña en texto plano)
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str)
+        """
+        try:
+            fecha_actual = _ahora_iso()
+            filas = [
+                (email, self._hash_password(password), fecha_actual)
+                for email, password in usuarios
+            ]
+            
+            with self._transaccion() as cursor:
+                cursor.executemany(_SQL_INSERTAR_USUARIO, filas)
+                for email, _, _ in filas:
+                    self._invalidar_usuario(email)
+            
+            return True, f"{len(filas)} usuarios creados exitosamente"
+            
+        except sqlite3.IntegrityError:
+            return False, "El email ya está registrado"
+        except Exception as e:
+            return False, f"Error al crear usuarios: {str(e)}"
+    
     def verificar_credenciales(self, email: str, password: str) -> Tuple[bool, str]:
         """
         Verifica si las credenciales son correctas.
@@ -118,60 +529,127 @@ class Database:
         Returns:
             Tupla (éxito: bool, mensaje: str)
         """
+        exito, mensaje, _ = self.verificar_credenciales_con_estado(email, password)
+        return exito, mensaje
+    
+    def verificar_credenciales_con_estado(
+        self, email: str, password: str
+    ) -> Tuple[bool, str, Optional[EstadoUsuario]]:
+        """
+        Verifica las credenciales y retorna además el estado resultante.
+        
+        El estado sale de la misma lectura que verifica la contraseña o, en un
+        fallo, del UPDATE ... RETURNING que cuenta el intento; quien llama no
+        necesita volver a leer al usuario para mostrar intentos o bloqueo.
+        
+        Args:
+            email: Email del usuario
+            password: Contraseña en texto plano
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str, estado), donde estado es
+            EstadoUsuario(bloqueado, intentos_fallidos) o None si no existe
+        """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._lock:
+                fila = self._conn.execute(_SQL_ESTADO_CREDENCIALES, (email,)).fetchone()
             
-            cursor.execute("""
-                SELECT password_hash, intentos_fallidos, bloqueado
-                FROM usuarios
-                WHERE email = ?
-            """, (email,))
+            if not fila:
+                self._verificar_password(password, self._hash_ficticio)
+                return False, "Usuario no encontrado", None
             
-            resultado = cursor.fetchone()
+            if fila['bloqueado'] == 1:
+                estado = EstadoUsuario(True, fila['intentos_fallidos'])
+                return False, "Usuario bloqueado por múltiples intentos fallidos", estado
             
-            if not resultado:
-                conn.close()
-                return False, "Usuario no encontrado"
+            # bcrypt es deliberadamente lento: corre sin retener el lock para
+            # que otros hilos sigan usando la conexión mientras tanto
+            if self._verificar_password(password, fila['password_hash']):
+                return self._registrar_exito(email, fila)
             
-            if resultado['bloqueado'] == 1:
-                conn.close()
-                return False, "Usuario bloqueado por múltiples intentos fallidos"
+            if self.diferir_intentos:
+                return self._registrar_fallo_diferido(email, fila)
             
-            password_hash = self._hash_password(password)
+            with self._lock:
+                filas = self._conn.execute(
+                    _SQL_REGISTRAR_FALLO, (_ahora_iso(), email)
+                ).fetchall()
+                self._invalidar_usuario(email)
+            
+            if not filas:
+                # Otro hilo lo bloqueó entre la lectura y la escritura
+                return False, "Usuario bloqueado por múltiples intentos fallidos", \
+                    EstadoUsuario(True, fila['intentos_fallidos'])
+            
+            estado = EstadoUsuario(filas[0]['bloqueado'] == 1, filas[0]['intentos_fallidos'])
+            if estado.bloqueado:
+                return False, "Usuario bloqueado por múltiples intentos fallidos", estado
+            
+            intentos_restantes = 5 - estado.intentos_fallidos
+            return False, f"Contraseña incorrecta. Intentos restantes: {intentos_restantes}", estado
             
-            if password_hash == resultado['password_hash']:
-                # Login exitoso - resetear intentos fallidos
-                cursor.execute("""
-                    UPDATE usuarios
-                    SET intentos_fallidos = 0, ultimo_intento = ?
-                    WHERE email = ?
-                """, (datetime.now().isoformat(), email))
-                conn.commit()
-                conn.close()
-                return True, "Login exitoso"
-            else:
-                # Incrementar intentos fallidos
-                nuevos_intentos = resultado['intentos_fallidos'] + 1
-                bloqueado = 1 if nuevos_intentos >= 5 else 0
-                
-                cursor.execute("""
-                    UPDATE usuarios
-                    SET intentos_fallidos = ?, bloqueado = ?, ultimo_intento = ?
-                    WHERE email = ?
-                """, (nuevos_intentos, bloqueado, datetime.now().isoformat(), email))
-                
-                conn.commit()
-                conn.close()
-                
-                intentos_restantes = 5 - nuevos_intentos
-                if bloqueado:
-                    return False, "Usuario bloqueado por múltiples intentos fallidos"
-                else:
-                    return False, f"Contraseña incorrecta. Intentos restantes: {intentos_restantes}"
-                    
         except Exception as e:
-            return False, f"Error al verificar credenciales: {str(e)}"
+            return False, f"Error al verificar credenciales: {str(e)}", None
+    
+    def _registrar_exito(
+        self, email: str, fila: sqlite3.Row
+    ) -> Tuple[bool, str, Optional[EstadoUsuario]]:
+        """
+        Reinicia los intentos tras un login correcto.
+        
+        Args:
+            email: Email del usuario
+            fila: Estado leído antes de verificar
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str, estado) como en
+            verificar_credenciales_con_estado
+        """
+        with self._lock:
+            self._pending_attempts.pop(email, None)
+            cursor = self._conn.execute(_SQL_REGISTRAR_EXITO, (_ahora_iso(), email))
+            self._invalidar_usuario(email)
+        
+        if cursor.rowcount == 0:
+            # Otro hilo lo bloqueó entre la lectura y la escritura
+            return False, "Usuario bloqueado por múltiples intentos fallidos", \
+                EstadoUsuario(True, fila['intentos_fallidos'])
+        
+        return True, "Login exitoso", EstadoUsuario(False, 0)
+    
+    def _registrar_fallo_diferido(
+        self, email: str, fila: sqlite3.Row
+    ) -> Tuple[bool, str, Optional[EstadoUsuario]]:
+        """
+        Acumula en memoria un intento fallido en lugar de escribirlo.
+        
+        Solo escribe al instante cuando el fallo bloquea al usuario.
+        
+        Args:
+            email: Email del usuario
+            fila: Estado leído antes de verificar
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str, estado) como en
+            verificar_credenciales_con_estado
+        """
+        with self._lock:
+            pendiente = self._pending_attempts.get(email)
+            intentos = (pendiente[0] if pendiente else fila['intentos_fallidos']) + 1
+            
+            if intentos >= 5:
+                # El bloqueo es crítico para la seguridad: se persiste ya
+                self._pending_attempts.pop(email, None)
+                self._conn.execute(_SQL_BLOQUEAR_USUARIO, (intentos, _ahora_iso(), email))
+            else:
+                self._pending_attempts[email] = (intentos, _ahora_iso())
+                self._programar_flush()
+            self._invalidar_usuario(email)
+        
+        estado = EstadoUsuario(intentos >= 5, intentos)
+        if estado.bloqueado:
+            return False, "Usuario bloqueado por múltiples intentos fallidos", estado
+        return False, f"Contraseña incorrecta. Intentos restantes: {5 - intentos}", estado
     
     def obtener_usuario(self, email: str) -> Optional[dict]:
         """
@@ -184,26 +662,85 @@ class Database:
             Diccionario con datos del usuario o None si no existe
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, email, fecha_creacion, intentos_fallidos, bloqueado
-                FROM usuarios
-                WHERE email = ?
-            """, (email,))
+            with self._lock:
+                entrada = self._user_cache.get(email)
+                if entrada is not None:
+                    if time.monotonic() - entrada[0] < self._USER_TTL:
+                        self._user_cache.move_to_end(email)
+                        return dict(entrada[1])
+                    del self._user_cache[email]
+                
+                resultado = self._conn.execute(_SQL_OBTENER_USUARIO, (email,)).fetchone()
+                
+                if not resultado:
+                    return None
+                
+                usuario = dict(resultado)
+                # Reflejar intentos fallidos aún no escritos en disco
+                pendiente = self._pending_attempts.get(email)
+                if pendiente is not None:
+                    usuario['intentos_fallidos'] = pendiente[0]
+                self._user_cache[email] = (time.monotonic(), usuario)
+                if len(self._user_cache) > self._USER_CACHE_MAX:
+                    self._user_cache.popitem(last=False)
             
-            resultado = cursor.fetchone()
-            conn.close()
+            return dict(usuario)
             
-            if resultado:
-                return dict(resultado)
+        except Exception as e:
+            print(f"Error al obtener usuario: {e}")
             return None
+    
+    def obtener_estado_usuario(self, email: str) -> Optional[EstadoUsuario]:
+        """
+        Obtiene solo el estado de bloqueo y los intentos fallidos de un usuario.
+        
+        Lectura ligera para quien no necesita el resto de los datos: se
+        resuelve con el índice de verificación y no construye un diccionario.
+        
+        Args:
+            email: Email del usuario
+            
+        Returns:
+            EstadoUsuario(bloqueado, intentos_fallidos) o None si no existe
+        """
+        try:
+            with self._lock:
+                resultado = self._conn.execute(_SQL_ESTADO_USUARIO, (email,)).fetchone()
+                if not resultado:
+                    return None
+                
+                pendiente = self._pending_attempts.get(email)
+                intentos = pendiente[0] if pendiente is not None else resultado[1]
+            
+            return EstadoUsuario(resultado[0] == 1, intentos)
             
         except Exception as e:
-            print(f"Error al obtener usuario: {e}")
+            print(f"Error al obtener estado de usuario: {e}")
             return None
     
+    def usuarios_existen(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Indica cuáles de los emails dados están registrados.
+        
+        Resuelve toda la lista en una sola consulta en lugar de una por email.
+        
+        Args:
+            emails: Emails a comprobar
+            
+        Returns:
+            Conjunto con los emails que existen en la base de datos
+        """
+        try:
+            with self._lock:
+                filas = self._conn.execute(
+                    _SQL_USUARIOS_EXISTEN, (json.dumps(list(emails)),)
+                ).fetchall()
+            return {fila[0] for fila in filas}
+            
+        except Exception as e:
+            print(f"Error al comprobar usuarios: {e}")
+            return set()
+    
     def crear_token_recuperacion(self, email: str, token: str) -> Tuple[bool, str]:
         """
         Crea un token de recuperación de contraseña.
@@ -216,16 +753,9 @@ class Database:
             Tupla (éxito: bool, mensaje: str)
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._lock:
+                self._conn.execute(_SQL_INSERTAR_TOKEN, (email, token, _ahora_utc_iso()))
             
-            cursor.execute("""
-                INSERT INTO recovery_tokens (email, token, fecha_creacion)
-                VALUES (?, ?, ?)
-            """, (email, token, datetime.now().isoformat()))
-            
-            conn.commit()
-            conn.close()
             return True, "Token creado exitosamente"
             
         except Exception as e:
@@ -243,28 +773,96 @@ class Database:
             Tupla (éxito: bool, mensaje: str)
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
             password_hash = self._hash_password(nueva_password)
             
-            cursor.execute("""
-                UPDATE usuarios
-                SET password_hash = ?, intentos_fallidos = 0, bloqueado = 0
-                WHERE email = ?
-            """, (password_hash, email))
+            with self._lock:
+                cursor = self._conn.execute(_SQL_CAMBIAR_PASSWORD, (password_hash, email))
+                self._pending_attempts.pop(email, None)
+                self._invalidar_usuario(email)
             
             if cursor.rowcount == 0:
-                conn.close()
                 return False, "Usuario no encontrado"
             
-            conn.commit()
-            conn.close()
             return True, "Contraseña actualizada exitosamente"
             
         except Exception as e:
             return False, f"Error al cambiar contraseña: {str(e)}"
     
+    def cambiar_password_con_token(
+        self, email: str, token: str, nueva_password: str
+    ) -> Tuple[bool, str]:
+        """
+        Cambia la contraseña de un usuario si presenta un token de recuperación válido.
+        
+        El token debe ser el último emitido para el email, no haberse usado y
+        tener menos de _TOKEN_VIGENCIA segundos. La vigencia se revisa antes
+        de comparar y la comparación es en tiempo constante; la nueva
+        contraseña solo se hashea con un token válido. Al usarlo se anulan
+        todos los tokens pendientes del email.
+        
+        Args:
+            email: Email del usuario
+            token: Token de recuperación recibido
+            nueva_password: Nueva contraseña en texto plano
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str)
+        """
+        try:
+            with self._lock:
+                fila = self._conn.execute(_SQL_ULTIMO_TOKEN, (email,)).fetchone()
+            
+            # El mismo mensaje para todos los casos: no revela cuál falló
+            if fila is None or fila['fecha_creacion'] < _ahora_utc_iso(-self._TOKEN_VIGENCIA):
+                return False, "Token inválido o expirado"
+            if not hmac.compare_digest(fila['token'].encode(), token.encode()):
+                return False, "Token inválido o expirado"
+            
+            password_hash = self._hash_password(nueva_password)
+            
+            # Un return dentro del bloque confirmaría el token gastado sin
+            # haber cambiado la contraseña: los rechazos lanzan y se deshacen
+            with self._transaccion() as cursor:
+                if cursor.execute(_SQL_USAR_TOKEN, (fila['id'],)).rowcount == 0:
+                    # Otro hilo usó el token mientras se hasheaba
+                    raise _CambioRechazado("Token inválido o expirado")
+                cursor.execute(_SQL_ANULAR_TOKENS, (email,))
+                if cursor.execute(_SQL_CAMBIAR_PASSWORD, (password_hash, email)).rowcount == 0:
+                    raise _CambioRechazado("Usuario no encontrado")
+                self._pending_attempts.pop(email, None)
+                self._invalidar_usuario(email)
+            
+            return True, "Contraseña actualizada exitosamente"
+            
+        except _CambioRechazado as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"Error al cambiar contraseña: {str(e)}"
+    
+    def bloquear_usuario(self, email: str) -> Tuple[bool, str]:
+        """
+        Bloquea un usuario como si hubiera agotado sus 5 intentos.
+        
+        Args:
+            email: Email del usuario
+            
+        Returns:
+            Tupla (éxito: bool, mensaje: str)
+        """
+        try:
+            with self._lock:
+                cursor = self._conn.execute(_SQL_BLOQUEAR_USUARIO, (5, _ahora_iso(), email))
+                self._pending_attempts.pop(email, None)
+                self._invalidar_usuario(email)
+            
+            if cursor.rowcount == 0:
+                return False, "Usuario no encontrado"
+            
+            return True, "Usuario bloqueado exitosamente"
+            
+        except Exception as e:
+            return False, f"Error al bloquear usuario: {str(e)}"
+    
     def desbloquear_usuario(self, email: str) -> Tuple[bool, str]:
         """
         Desbloquea un usuario y resetea sus intentos fallidos.
@@ -276,21 +874,14 @@ class Database:
             Tupla (éxito: bool, mensaje: str)
         """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE usuarios
-                SET intentos_fallidos = 0, bloqueado = 0
-                WHERE email = ?
-            """, (email,))
+            with self._lock:
+                cursor = self._conn.execute(_SQL_DESBLOQUEAR_USUARIO, (email,))
+                self._pending_attempts.pop(email, None)
+                self._invalidar_usuario(email)
             
             if cursor.rowcount == 0:
-                conn.close()
                 return False, "Usuario no encontrado"
             
-            conn.commit()
-            conn.close()
             return True, "Usuario desbloqueado exitosamente"
             
         except Exception as e:
@@ -2,16 +2,41 @@
 Interfaz gráfica de autenticación usando tkinter.
 Pantalla moderna con colores y validaciones visuales.
 """
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
 from typing import Optional
-from src.database import Database
-from src.auth_service import AuthService
 
 
 class LoginUI:
     """Interfaz gráfica para el sistema de autenticación."""
     
+    # Milisegundos sin teclear antes de validar en tiempo real
+    _DEBOUNCE_MS = 250
+    
+    # Colores modernos
+    color_fondo = "#1e1e2e"
+    color_primario = "#89b4fa"
+    color_secundario = "#cba6f7"
+    color_texto = "#cdd6f4"
+    color_error = "#f38ba8"
+    color_exito = "#a6e3a1"
+    color_campo = "#313244"
+    
+    # Opciones de estilo compartidas por varios labels (se arman una sola vez)
+    LABEL_FIELD = {
+        "font": ("Segoe UI", 11, "bold"),
+        "bg": color_fondo,
+        "fg": color_texto,
+        "anchor": 'w'
+    }
+    LABEL_ERROR = {
+        "font": ("Segoe UI", 9),
+        "bg": color_fondo,
+        "fg": color_error,
+        "anchor": 'w'
+    }
+    
     def __init__(self):
         """Inicializa la ventana principal y los componentes."""
         self.ventana = tk.Tk()
@@ -19,34 +44,64 @@ class LoginUI:
         self.ventana.geometry("450x600")
         self.ventana.resizable(False, False)
         
-        # Colores modernos
-        self.color_fondo = "#1e1e2e"
-        self.color_primario = "#89b4fa"
-        self.color_secundario = "#cba6f7"
-        self.color_texto = "#cdd6f4"
-        self.color_error = "#f38ba8"
-        self.color_exito = "#a6e3a1"
-        self.color_campo = "#313244"
-        
         self.ventana.configure(bg=self.color_fondo)
         
-        # Inicializar servicios
-        self.db = Database()
-        self.auth_service = AuthService(self.db)
+        # Servicios: se crean al primer uso (ver propiedad auth_service) para
+        # que la ventana se dibuje sin esperar a abrir la base de datos
+        self._db = None
+        self._auth_service = None
+        self._servicios_lock = threading.Lock()
         
         # Variables
         self.email_var = tk.StringVar()
         self.password_var = tk.StringVar()
         self.modo_registro = False
         
+        # Validaciones en tiempo real pendientes (id de ventana.after)
+        self._email_after_id = None
+        self._password_after_id = None
+        
+        # True mientras un login/registro se ejecuta en segundo plano
+        self._ocupado = False
+        
+        # Ocultamiento pendiente del aviso temporal (id de ventana.after)
+        self._toast_after_id = None
+        
         # Construir interfaz
         self._crear_interfaz()
     
+    @property
+    def auth_service(self):
+        """Servicio de autenticación, creado junto con la BD en el primer acceso."""
+        if self._auth_service is None:
+            # El login/registro corre en otro hilo: evitar crear dos instancias
+            with self._servicios_lock:
+                if self._auth_service is None:
+                    from src.database import Database
+                    from src.auth_service import AuthService
+                    self._db = Database()
+                    self._auth_service = AuthService(self._db)
+        return self._auth_service
+    
+    @property
+    def db(self):
+        """Base de datos compartida con el servicio de autenticación."""
+        return self.auth_service.db
+    
     def _crear_interfaz(self):
         """Crea todos los elementos de la interfaz."""
         # Frame principal
         frame_principal = tk.Frame(self.ventana, bg=self.color_fondo)
         frame_principal.pack(expand=True, fill='both', padx=30, pady=30)
+        # El tamaño lo fija la ventana, no el contenido: agregar widgets no
+        # obliga a recalcular la geometría del frame
+        frame_principal.pack_propagate(False)
+        
+        # (widget, opciones de pack): se empaquetan todos juntos al final
+        pendientes = []
+        
+        # Estilos ttk: se configuran una vez y los comparten todos los widgets
+        self._configurar_estilos()
         
         # Título
         self.label_titulo = tk.Label(
@@ -56,7 +111,7 @@ class LoginUI:
             bg=self.color_fondo,
             fg=self.color_primario
         )
-        self.label_titulo.pack(pady=(0, 30))
+        pendientes.append((self.label_titulo, dict(pady=(0, 30))))
         
         # Subtítulo informativo
         self.label_info = tk.Label(
@@ -66,76 +121,56 @@ class LoginUI:
             bg=self.color_fondo,
             fg=self.color_texto
         )
-        self.label_info.pack(pady=(0, 20))
+        pendientes.append((self.label_info, dict(pady=(0, 20))))
         
         # Campo Email
         label_email = tk.Label(
             frame_principal,
             text="📧 Email",
-            font=("Segoe UI", 11, "bold"),
-            bg=self.color_fondo,
-            fg=self.color_texto,
-            anchor='w'
+            **self.LABEL_FIELD
         )
-        label_email.pack(fill='x', pady=(10, 5))
+        pendientes.append((label_email, dict(fill='x', pady=(10, 5))))
         
-        self.entry_email = tk.Entry(
+        self.entry_email = ttk.Entry(
             frame_principal,
             textvariable=self.email_var,
             font=("Segoe UI", 12),
-            bg=self.color_campo,
-            fg=self.color_texto,
-            insertbackground=self.color_texto,
-            relief='flat',
-            bd=5
+            style='Dark.TEntry'
         )
-        self.entry_email.pack(fill='x', ipady=8)
+        pendientes.append((self.entry_email, dict(fill='x', ipady=8)))
         
         # Mensaje de validación email
         self.label_email_error = tk.Label(
             frame_principal,
             text="",
-            font=("Segoe UI", 9),
-            bg=self.color_fondo,
-            fg=self.color_error,
-            anchor='w'
+            **self.LABEL_ERROR
         )
-        self.label_email_error.pack(fill='x')
+        pendientes.append((self.label_email_error, dict(fill='x')))
         
         # Campo Contraseña
         label_password = tk.Label(
             frame_principal,
             text="🔑 Contraseña",
-            font=("Segoe UI", 11, "bold"),
-            bg=self.color_fondo,
-            fg=self.color_texto,
-            anchor='w'
+            **self.LABEL_FIELD
         )
-        label_password.pack(fill='x', pady=(15, 5))
+        pendientes.append((label_password, dict(fill='x', pady=(15, 5))))
         
-        self.entry_password = tk.Entry(
+        self.entry_password = ttk.Entry(
             frame_principal,
             textvariable=self.password_var,
             font=("Segoe UI", 12),
-            bg=self.color_campo,
-            fg=self.color_texto,
-            insertbackground=self.color_texto,
             show="●",
-            relief='flat',
-            bd=5
+            style='Dark.TEntry'
         )
-        self.entry_password.pack(fill='x', ipady=8)
+        pendientes.append((self.entry_password, dict(fill='x', ipady=8)))
         
         # Mensaje de validación password
         self.label_password_error = tk.Label(
             frame_principal,
             text="",
-            font=("Segoe UI", 9),
-            bg=self.color_fondo,
-            fg=self.color_error,
-            anchor='w'
+            **self.LABEL_ERROR
         )
-        self.label_password_error.pack(fill='x')
+        pendientes.append((self.label_password_error, dict(fill='x')))
         
         # Requisitos de contraseña (solo visible en modo registro)
         self.label_requisitos = tk.Label(
@@ -148,22 +183,18 @@ class LoginUI:
         )
         
         # Botón principal (Login/Registro)
-        self.btn_principal = tk.Button(
+        self.btn_principal = ttk.Button(
             frame_principal,
             text="INICIAR SESIÓN",
-            font=("Segoe UI", 12, "bold"),
-            bg=self.color_primario,
-            fg=self.color_fondo,
-            activebackground=self.color_secundario,
-            activeforeground=self.color_fondo,
-            relief='flat',
+            style='Primary.TButton',
             cursor='hand2',
             command=self._accion_principal
         )
-        self.btn_principal.pack(fill='x', pady=(25, 10), ipady=10)
+        pendientes.append((self.btn_principal, dict(fill='x', pady=(25, 10), ipady=10)))
         
         # Línea separadora
-        tk.Frame(frame_principal, height=1, bg=self.color_campo).pack(fill='x', pady=15)
+        separador = tk.Frame(frame_principal, height=1, bg=self.color_campo)
+        pendientes.append((separador, dict(fill='x', pady=15)))
         
         # Botón recuperar contraseña
         btn_recuperar = tk.Button(
@@ -179,23 +210,17 @@ class LoginUI:
             bd=0,
             command=self._recuperar_password
         )
-        btn_recuperar.pack(pady=5)
+        pendientes.append((btn_recuperar, dict(pady=5)))
         
         # Botón cambiar modo
-        self.btn_cambiar_modo = tk.Button(
+        self.btn_cambiar_modo = ttk.Button(
             frame_principal,
             text="¿No tienes cuenta? Regístrate",
-            font=("Segoe UI", 9, "bold"),
-            bg=self.color_fondo,
-            fg=self.color_primario,
-            activebackground=self.color_fondo,
-            activeforeground=self.color_secundario,
-            relief='flat',
+            style='Link.TButton',
             cursor='hand2',
-            bd=0,
             command=self._cambiar_modo
         )
-        self.btn_cambiar_modo.pack(pady=5)
+        pendientes.append((self.btn_cambiar_modo, dict(pady=5)))
         
         # Label de estado (intentos restantes, etc.)
         self.label_estado = tk.Label(
@@ -205,39 +230,151 @@ class LoginUI:
             bg=self.color_fondo,
             fg=self.color_texto
         )
-        self.label_estado.pack(pady=(15, 0))
+        pendientes.append((self.label_estado, dict(pady=(15, 0))))
+        
+        # Aviso temporal con el resultado de login/registro (oculto por defecto)
+        self.label_toast = tk.Label(
+            frame_principal,
+            text="",
+            font=("Segoe UI", 10, "bold"),
+            bg=self.color_campo,
+            fg=self.color_texto,
+            wraplength=360,
+            justify='center'
+        )
+        
+        # Una sola pasada de geometría para toda la interfaz
+        for widget, opciones in pendientes:
+            widget.pack(**opciones)
+        self.ventana.update_idletasks()
         
         # Bind Enter key
-        self.ventana.bind('<Return>', lambda e: self._accion_principal())
+        self.ventana.bind('<Return>', self._accion_principal)
+        
+        # Validación en tiempo real con validatecommand de Tk (%P = valor nuevo):
+        # se registra una sola vez y cada callback decide según el modo actual
+        vcmd_email = (self.ventana.register(self._validar_email_tiempo_real), '%P')
+        self.entry_email.config(validate='key', validatecommand=vcmd_email)
+        vcmd_password = (self.ventana.register(self._validar_password_tiempo_real), '%P')
+        self.entry_password.config(validate='key', validatecommand=vcmd_password)
+        
+        # El cursor arranca en el email para poder escribir sin hacer clic
+        self.entry_email.focus_set()
+    
+    def _configurar_estilos(self):
+        """Define los estilos ttk de campos y botones con los colores del tema."""
+        style = ttk.Style(self.ventana)
+        style.theme_use('clam')
+        
+        style.configure(
+            'Dark.TEntry',
+            fieldbackground=self.color_campo,
+            foreground=self.color_texto,
+            insertcolor=self.color_texto,
+            borderwidth=0,
+            padding=5
+        )
+        
+        style.configure(
+            'Primary.TButton',
+            background=self.color_primario,
+            foreground=self.color_fondo,
+            font=("Segoe UI", 12, "bold"),
+            borderwidth=0
+        )
+        style.map(
+            'Primary.TButton',
+            background=[('disabled', self.color_campo), ('active', self.color_secundario)],
+            foreground=[('active', self.color_fondo)]
+        )
+        
+        style.configure(
+            'Link.TButton',
+            background=self.color_fondo,
+            foreground=self.color_primario,
+            font=("Segoe UI", 9, "bold"),
+            borderwidth=0
+        )
+        style.map(
+            'Link.TButton',
+            background=[('active', self.color_fondo)],
+            foreground=[('active', self.color_secundario)]
+        )
+    
+    def _validar_email_tiempo_real(self, nuevo_valor: str) -> bool:
+        """
+        Agenda la validación del email cuando el usuario deja de escribir.
+        
+        Args:
+            nuevo_valor: Contenido del campo tras la tecla pulsada
+            
+        Returns:
+            Siempre True (la entrada nunca se rechaza, solo se informa)
+        """
+        if not self.modo_registro:
+            return True
+        
+        if self._email_after_id is not None:
+            self.ventana.after_cancel(self._email_after_id)
+        self._email_after_id = self.ventana.after(
+            self._DEBOUNCE_MS, self._do_validar_email, nuevo_valor
+        )
+        return True
     
-    def _validar_email_tiempo_real(self, event=None):
-        """Valida el email mientras el usuario escribe."""
-        email = self.email_var.get()
+    def _do_validar_email(self, email: str):
+        """Valida el email escrito hasta el momento."""
+        self._email_after_id = None
         if len(email) == 0:
             self.label_email_error.config(text="")
             return
         
-        valido, mensaje = self.auth_service.validar_email(email)
+        # Validación pura: no hace falta abrir la BD desde el hilo de Tk
+        from src.auth_service import AuthService
+        valido, mensaje = AuthService.validar_email(email)
         if not valido:
-            self.label_email_error.config(text=f"❌ {mensaje}")
+            self.label_email_error.config(text=f"• {mensaje}")
         else:
             self.label_email_error.config(text="✓ Email válido", fg=self.color_exito)
     
-    def _validar_password_tiempo_real(self, event=None):
-        """Valida la contraseña mientras el usuario escribe."""
-        password = self.password_var.get()
+    def _validar_password_tiempo_real(self, nuevo_valor: str) -> bool:
+        """
+        Agenda la validación de la contraseña cuando el usuario deja de escribir.
+        
+        Args:
+            nuevo_valor: Contenido del campo tras la tecla pulsada
+            
+        Returns:
+            Siempre True (la entrada nunca se rechaza, solo se informa)
+        """
+        if not self.modo_registro:
+            return True
+        
+        if self._password_after_id is not None:
+            self.ventana.after_cancel(self._password_after_id)
+        self._password_after_id = self.ventana.after(
+            self._DEBOUNCE_MS, self._do_validar_password, nuevo_valor
+        )
+        return True
+    
+    def _do_validar_password(self, password: str):
+        """Valida la contraseña escrita hasta el momento."""
+        self._password_after_id = None
         if len(password) == 0 or not self.modo_registro:
             self.label_password_error.config(text="")
             return
         
-        valido, mensaje = self.auth_service.validar_password(password)
+        from src.auth_service import AuthService
+        valido, mensaje = AuthService.validar_password(password)
         if not valido:
-            self.label_password_error.config(text=f"❌ {mensaje}")
+            self.label_password_error.config(text=f"• {mensaje}")
         else:
             self.label_password_error.config(text="✓ Contraseña válida", fg=self.color_exito)
     
-    def _accion_principal(self):
-        """Ejecuta login o registro según el modo actual."""
+    def _accion_principal(self, event=None):
+        """Ejecuta login o registro según el modo actual (botón o tecla Enter)."""
+        if self._ocupado:
+            return
+        
         if self.modo_registro:
             self._registrar()
         else:
@@ -254,36 +391,79 @@ class LoginUI:
         
         # Validar campos vacíos
         if not email:
-            self.label_email_error.config(text="❌ El email es requerido")
+            self.label_email_error.config(text="• El email es requerido")
             return
         
         if not password:
-            self.label_password_error.config(text="❌ La contraseña es requerida")
+            self.label_password_error.config(text="• La contraseña es requerida")
             return
         
-        # Intentar login
-        exito, mensaje = self.auth_service.iniciar_sesion(email, password)
+        # Intentar login fuera del hilo de Tk para no congelar la ventana
+        self._iniciar_operacion()
+        threading.Thread(
+            target=self._login_worker, args=(email, password), daemon=True
+        ).start()
+    
+    def _iniciar_operacion(self):
+        """Deshabilita el botón principal mientras trabaja el hilo secundario."""
+        self._ocupado = True
+        self.btn_principal.config(state='disabled')
+    
+    def _finalizar_operacion(self):
+        """Rehabilita el botón principal al volver al hilo de Tk."""
+        self._ocupado = False
+        self.btn_principal.config(state='normal')
+    
+    def _login_worker(self, email: str, password: str):
+        """
+        Ejecuta el login en un hilo secundario.
+        
+        El estado del usuario (bloqueo e intentos) llega en el mismo
+        resultado, sin consultas adicionales a la base de datos.
+        """
+        exito, mensaje, intentos, bloqueado = self.auth_service.iniciar_sesion_con_estado(
+            email, password
+        )
+        
+        # Los widgets solo se tocan desde el hilo de Tk
+        self.ventana.after(0, self._login_done, exito, mensaje, email, bloqueado, intentos)
+    
+    def _toast(self, texto: str, color: str):
+        """
+        Muestra un aviso dentro de la ventana que se oculta solo (no modal).
+        
+        Args:
+            texto: Mensaje a mostrar
+            color: Color del texto
+        """
+        if self._toast_after_id is not None:
+            self.ventana.after_cancel(self._toast_after_id)
+        self.label_toast.config(text=texto, fg=color)
+        self.label_toast.pack(fill='x', pady=(10, 0), ipady=6)
+        self._toast_after_id = self.ventana.after(3000, self._ocultar_toast)
+    
+    def _ocultar_toast(self):
+        """Oculta el aviso temporal."""
+        self._toast_after_id = None
+        self.label_toast.pack_forget()
+    
+    def _login_done(self, exito: bool, mensaje: str, email: str,
+                    bloqueado: bool, intentos: int):
+        """Muestra el resultado del login (se ejecuta en el hilo de Tk)."""
+        self._finalizar_operacion()
         
         if exito:
-            messagebox.showinfo(
-                "✓ Login Exitoso",
-                f"¡Bienvenido!\n\nHas iniciado sesión correctamente como:\n{email}"
-            )
+            self._toast(f"✓ ¡Bienvenido! Sesión iniciada como {email}", self.color_exito)
             self._limpiar_campos()
         else:
-            messagebox.showerror("✗ Error de Autenticación", mensaje)
+            self._toast(mensaje, self.color_error)
             
             # Mostrar intentos restantes si el usuario existe
-            if not self.auth_service.usuario_esta_bloqueado(email):
-                intentos = self.auth_service.obtener_intentos_restantes(email)
-                if intentos > 0:
-                    self.label_estado.config(
-                        text=f"⚠ Intentos restantes: {intentos}",
-                        fg=self.color_error
-                    )
-            else:
+            if bloqueado:
+                self.label_estado.config(text="• Usuario bloqueado", fg=self.color_error)
+            elif intentos > 0:
                 self.label_estado.config(
-                    text="🔒 Usuario bloqueado",
+                    text=f"• Intentos restantes: {intentos}",
                     fg=self.color_error
                 )
     
@@ -296,24 +476,39 @@ class LoginUI:
         self.label_email_error.config(text="")
         self.label_password_error.config(text="")
         
-        # Intentar registro
+        # Intentar registro fuera del hilo de Tk
+        self._iniciar_operacion()
+        threading.Thread(
+            target=self._registrar_worker, args=(email, password), daemon=True
+        ).start()
+    
+    def _registrar_worker(self, email: str, password: str):
+        """Ejecuta el registro en un hilo secundario."""
         exito, mensaje = self.auth_service.registrar_usuario(email, password)
+        self.ventana.after(0, self._registrar_done, exito, mensaje, email)
+    
+    def _registrar_done(self, exito: bool, mensaje: str, email: str):
+        """Muestra el resultado del registro (se ejecuta en el hilo de Tk)."""
+        self._finalizar_operacion()
         
         if exito:
-            messagebox.showinfo(
-                "✓ Registro Exitoso",
-                f"Usuario creado correctamente.\n\nYa puedes iniciar sesión con:\n{email}"
+            self._toast(
+                f"✓ Usuario creado. Ya puedes iniciar sesión con {email}",
+                self.color_exito
             )
             self._limpiar_campos()
             self._cambiar_modo()  # Volver a modo login
         else:
             if "email" in mensaje.lower():
-                self.label_email_error.config(text=f"❌ {mensaje}")
+                self.label_email_error.config(text=f"• {mensaje}")
             else:
-                self.label_password_error.config(text=f"❌ {mensaje}")
+                self.label_password_error.config(text=f"• {mensaje}")
     
     def _recuperar_password(self):
         """Muestra diálogo para recuperar contraseña."""
+        if self._ocupado:
+            return
+        
         email = self.email_var.get().strip()
         
         if not email:
@@ -323,17 +518,32 @@ class LoginUI:
             )
             return
         
+        # La consulta y la creación del token tocan la BD: fuera del hilo de Tk
+        self._iniciar_operacion()
+        threading.Thread(
+            target=self._recuperar_worker, args=(email,), daemon=True
+        ).start()
+    
+    def _recuperar_worker(self, email: str):
+        """Solicita la recuperación en un hilo secundario."""
         # Validar que el usuario existe
         usuario = self.db.obtener_usuario(email)
         if not usuario:
-            messagebox.showerror(
-                "Error",
-                "El email no está registrado en el sistema."
+            self.ventana.after(
+                0, self._recuperar_done, False,
+                "El email no está registrado en el sistema.", email
             )
             return
         
         # Solicitar recuperación (sin credenciales SMTP se obtiene el token)
-        exito, mensaje = self.auth_service.solicitar_recuperacion_password(email)
+        exito, mensaje = self.auth_service.solicitar_recuperacion_password(
+            email, usuario=usuario
+        )
+        self.ventana.after(0, self._recuperar_done, exito, mensaje, email)
+    
+    def _recuperar_done(self, exito: bool, mensaje: str, email: str):
+        """Muestra el diálogo de recuperación (se ejecuta en el hilo de Tk)."""
+        self._finalizar_operacion()
         
         if exito:
             # Extraer token del mensaje
@@ -383,9 +593,12 @@ class LoginUI:
                     fg=self.color_secundario
                 ).pack(pady=5)
                 
-                def cambiar():
-                    nueva_pass = nueva_pass_var.get()
-                    exito_cambio, msg_cambio = self.auth_service.cambiar_password(email, nueva_pass)
+                def cambiar_done(exito_cambio: bool, msg_cambio: str):
+                    # De vuelta en el hilo de Tk
+                    self._finalizar_operacion()
+                    if not ventana_recovery.winfo_exists():
+                        return
+                    btn_cambiar.config(state='normal')
                     
                     if exito_cambio:
                         messagebox.showinfo("✓ Éxito", "Contraseña actualizada correctamente")
@@ -393,7 +606,24 @@ class LoginUI:
                     else:
                         messagebox.showerror("✗ Error", msg_cambio)
                 
-                tk.Button(
+                def cambiar_worker(nueva_pass: str):
+                    # bcrypt tarda cientos de ms: fuera del hilo de Tk
+                    exito_cambio, msg_cambio = self.auth_service.cambiar_password(
+                        email, token, nueva_pass
+                    )
+                    self.ventana.after(0, cambiar_done, exito_cambio, msg_cambio)
+                
+                def cambiar():
+                    if self._ocupado:
+                        return
+                    
+                    self._iniciar_operacion()
+                    btn_cambiar.config(state='disabled')
+                    threading.Thread(
+                        target=cambiar_worker, args=(nueva_pass_var.get(),), daemon=True
+                    ).start()
+                
+                btn_cambiar = tk.Button(
                     ventana_recovery,
                     text="CAMBIAR CONTRASEÑA",
                     font=("Segoe UI", 10, "bold"),
@@ -402,7 +632,10 @@ class LoginUI:
                     relief='flat',
                     cursor='hand2',
                     command=cambiar
-                ).pack(pady=15, padx=20, fill='x', ipady=8)
+                )
+                btn_cambiar.pack(pady=15, padx=20, fill='x', ipady=8)
+        else:
+            messagebox.showerror("Error", mensaje)
     
     def _cambiar_modo(self):
         """Alterna entre modo login y registro."""
@@ -417,10 +650,6 @@ class LoginUI:
             self.btn_principal.config(text="REGISTRARSE")
             self.btn_cambiar_modo.config(text="¿Ya tienes cuenta? Inicia sesión")
             self.label_requisitos.pack(fill='x', pady=(5, 0))
-            
-            # Activar validación en tiempo real
-            self.email_var.trace_add('write', lambda *args: self._validar_email_tiempo_real())
-            self.password_var.trace_add('write', lambda *args: self._validar_password_tiempo_real())
         else:
             self.label_titulo.config(text="🔐 INICIAR SESIÓN")
             self.label_info.config(text="Ingresa tus credenciales")
@@ -428,12 +657,22 @@ class LoginUI:
             self.btn_cambiar_modo.config(text="¿No tienes cuenta? Regístrate")
             self.label_requisitos.pack_forget()
             
-            # Desactivar validación en tiempo real (opcional en login)
             self.label_email_error.config(text="")
             self.label_password_error.config(text="", fg=self.color_error)
     
+    def _cancelar_validaciones(self):
+        """Descarta las validaciones en tiempo real aún no ejecutadas."""
+        for after_id in (self._email_after_id, self._password_after_id):
+            if after_id is not None:
+                self.ventana.after_cancel(after_id)
+        self._email_after_id = None
+        self._password_after_id = None
+    
     def _limpiar_campos(self):
         """Limpia todos los campos y mensajes de error."""
+        # Asignar la variable no dispara validatecommand: una validación
+        # pendiente mostraría el valor anterior
+        self._cancelar_validaciones()
         self.email_var.set("")
         self.password_var.set("")
         self.label_email_error.config(text="")
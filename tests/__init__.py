@@ -1,3 +1,6 @@
 """
 Paquete de pruebas del sistema de autenticación.
 """
+
+# Costo mínimo de bcrypt: las pruebas revisan el comportamiento, no la lentitud
+RONDAS_BCRYPT = 4
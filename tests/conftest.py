@@ -0,0 +1,77 @@
+"""
+Fixtures compartidas por los módulos de pruebas.
+
+Cada módulo usa una sola BD en memoria (db_test) y un solo servicio
+(auth_service); aislar_cambios deshace lo escrito por cada test con un
+SAVEPOINT, sin recrear el esquema.
+"""
+import secrets
+
+import pytest
+
+from src.auth_service import AuthService
+from src.database import Database
+from tests import RONDAS_BCRYPT
+
+
+@pytest.fixture(scope="module")
+def db_test():
+    """Fixture que crea una base de datos en memoria compartida por el módulo."""
+    # BD en memoria: sin archivo ni fsync, desaparece al cerrarla
+    db = Database(":memory:", rondas_bcrypt=RONDAS_BCRYPT)
+    yield db
+    # Cleanup
+    db.close()
+
+
+@pytest.fixture(scope="module")
+def auth_service(db_test):
+    """Fixture que crea un servicio de autenticación con BD de prueba."""
+    return AuthService(db_test)
+
+
+@pytest.fixture
+def emitir_token(db_test):
+    """
+    Fixture que emite tokens de recuperación con un valor conocido.
+    
+    Guarda el token directamente en la BD, sin depender del formato del
+    mensaje de solicitar_recuperacion_password.
+    
+    Returns:
+        Función emitir(email) -> token
+    """
+    def emitir(email: str) -> str:
+        token = secrets.token_hex(16)
+        exito, mensaje = db_test.crear_token_recuperacion(email, token)
+        assert exito is True, mensaje
+        return token
+    
+    return emitir
+
+
+def _descartar_estado_en_memoria(db: Database):
+    """
+    Descarta lo que la BD guarda en memoria sobre las filas.
+    
+    Tras un ROLLBACK esos datos describen filas deshechas; este es el único
+    lugar que debe conocer las cachés internas.
+    """
+    db._user_cache.clear()
+    db._pending_attempts.clear()
+
+
+@pytest.fixture(autouse=True)
+def aislar_cambios(request):
+    """Deshace al final de cada test lo que haya escrito en la BD compartida."""
+    if "db_test" not in request.fixturenames:
+        yield
+        return
+    
+    db = request.getfixturevalue("db_test")
+    conn = db._get_connection()
+    conn.execute("SAVEPOINT test")
+    yield
+    conn.execute("ROLLBACK TO test")
+    conn.execute("RELEASE test")
+    _descartar_estado_en_memoria(db)
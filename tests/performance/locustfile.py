@@ -9,10 +9,22 @@ Parámetros:
     -u: Número de usuarios concurrentes (100)
     -r: Tasa de spawn de usuarios por segundo (10)
     -t: Tiempo de ejecución (30 segundos)
+
+Costo de bcrypt:
+    AUTH_HASH_COST fija las rondas de bcrypt (por defecto 4, el mínimo).
+    El costo 4 es solo para pruebas: así se mide la lógica del servicio y no
+    el hash, que además bloquearía a los demás usuarios del worker (gevent).
+    Para medir el costo real: AUTH_HASH_COST=12 locust -f ...
 """
+import functools
+import itertools
+import os
 import sys
+import threading
 from pathlib import Path
+from time import perf_counter
 from locust import User, task, between, events
+from locust.runners import WorkerRunner
 import random
 
 # Agregar el directorio raíz al path
@@ -22,6 +34,103 @@ from src.database import Database
 from src.auth_service import AuthService
 
 
+# Contador para emails únicos (sin las colisiones de random.randint); el pid
+# distingue a los workers de Locust que comparten el mismo archivo de BD
+_uid_counter = itertools.count()
+_uid_lock = threading.Lock()
+
+
+def _nuevo_uid() -> str:
+    """Retorna un identificador único dentro de la ejecución."""
+    with _uid_lock:
+        n = next(_uid_counter)
+    return f"{os.getpid()}_{n}"
+
+
+# Base de datos compartida por todos los usuarios simulados (se crea en on_init)
+DB_PATH = "data/performance_test.db"
+_shared_db = None
+
+
+def _es_worker(environment) -> bool:
+    """Indica si el proceso es un worker de una ejecución distribuida."""
+    return isinstance(environment.runner, WorkerRunner)
+
+
+def _borrar_archivos_db():
+    """Elimina el archivo de la BD junto con sus archivos -wal y -shm."""
+    for sufijo in ("", "-wal", "-shm"):
+        Path(DB_PATH + sufijo).unlink(missing_ok=True)
+
+
+def _abrir_db_compartida(environment) -> Database:
+    """
+    Abre la BD de rendimiento y aplica los PRAGMA una sola vez.
+    
+    El proceso local o el master borra antes un archivo sobrante de una
+    ejecución interrumpida, para no medir con una caché ya caliente. Los
+    workers solo abren el archivo: borrarlo mientras otro worker lo tiene
+    abierto perdería o dividiría el estado del WAL.
+    """
+    if not _es_worker(environment):
+        _borrar_archivos_db()
+    
+    db = Database(DB_PATH, rondas_bcrypt=int(os.environ.get("AUTH_HASH_COST", "4")))
+    # Database ya activa WAL, synchronous=NORMAL y temp_store=MEMORY
+    db._get_connection().execute("PRAGMA mmap_size=268435456")
+    return db
+
+
+@events.init.add_listener
+def on_init(environment, **kwargs):
+    """Abre una sola conexión a la BD para todo el proceso de Locust."""
+    global _shared_db
+    _shared_db = _abrir_db_compartida(environment)
+
+
+def timed_task(nombre: str, request_type: str = "AUTH", esperado=True):
+    """
+    Decorador que mide una tarea y reporta el resultado a Locust.
+    
+    La tarea decorada retorna la tupla (éxito, mensaje) del servicio, o None
+    si no hizo nada (por ejemplo, usuario aún no registrado).
+    
+    Args:
+        nombre: Nombre de la petición en las estadísticas
+        request_type: Tipo de petición (AUTH, VALIDATION)
+        esperado: Resultado esperado (True/False) o None si cualquiera vale
+    """
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(self):
+            start_time = perf_counter()
+            largo = 0
+            try:
+                resultado = fn(self)
+                if resultado is None:
+                    return
+                
+                exito, mensaje = resultado
+                if esperado is None or exito == esperado:
+                    excepcion = None
+                    largo = len(mensaje)
+                else:
+                    excepcion = Exception(mensaje if esperado else "Debería haber fallado")
+            except Exception as e:
+                excepcion = e
+            
+            events.request.fire(
+                request_type=request_type,
+                name=nombre,
+                response_time=int((perf_counter() - start_time) * 1000),
+                response_length=largo,
+                exception=excepcion,
+                context={}
+            )
+        return envoltura
+    return decorador
+
+
 class AutenticacionUser(User):
     """
     Usuario simulado que ejecuta operaciones de autenticación.
@@ -31,15 +140,15 @@ class AutenticacionUser(User):
     wait_time = between(1, 3)
     
     def __init__(self, *args, **kwargs):
-        """Inicializa el usuario con su propia instancia de servicios."""
+        """Inicializa el usuario sobre la conexión compartida."""
         super().__init__(*args, **kwargs)
         
-        # Cada usuario tiene su propia conexión a la BD
-        self.db = Database("data/performance_test.db")
+        # Todos los usuarios comparten la misma conexión (serializada por lock)
+        self.db = _shared_db
         self.auth_service = AuthService(self.db)
         
         # Generar email único para este usuario
-        self.email = f"user_{random.randint(1, 1000000)}@loadtest.com"
+        self.email = f"user_{_nuevo_uid()}@loadtest.com"
         self.password = "Load123!"
         self.registered = False
     
@@ -51,219 +160,58 @@ class AutenticacionUser(User):
             self.registered = True
     
     @task(5)  # Peso 5: se ejecuta con más frecuencia
+    @timed_task("login_exitoso")
     def login_exitoso(self):
         """
         Tarea: Login con credenciales correctas.
         Esta es la operación más común (peso 5).
         """
-        if not self.registered:
-            return
-        
-        start_time = events.request.fire.__self__.time()
-        try:
-            exito, mensaje = self.auth_service.iniciar_sesion(
-                self.email, 
-                self.password
-            )
-            
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            
-            if exito:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="login_exitoso",
-                    response_time=total_time,
-                    response_length=len(mensaje),
-                    exception=None,
-                    context={}
-                )
-            else:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="login_exitoso",
-                    response_time=total_time,
-                    response_length=0,
-                    exception=Exception(mensaje),
-                    context={}
-                )
-        except Exception as e:
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            events.request.fire(
-                request_type="AUTH",
-                name="login_exitoso",
-                response_time=total_time,
-                response_length=0,
-                exception=e,
-                context={}
-            )
+        if self.registered:
+            return self.auth_service.iniciar_sesion(self.email, self.password)
     
     @task(2)  # Peso 2: menos frecuente
+    @timed_task("login_fallido", esperado=False)
     def login_fallido(self):
         """
         Tarea: Login con credenciales incorrectas.
         Simula errores de usuario (peso 2).
         """
-        if not self.registered:
-            return
-        
-        start_time = events.request.fire.__self__.time()
-        try:
-            exito, mensaje = self.auth_service.iniciar_sesion(
-                self.email, 
-                "PasswordIncorrecta123!"
-            )
-            
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            
-            events.request.fire(
-                request_type="AUTH",
-                name="login_fallido",
-                response_time=total_time,
-                response_length=len(mensaje),
-                exception=None if not exito else Exception("Debería haber fallado"),
-                context={}
-            )
-        except Exception as e:
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            events.request.fire(
-                request_type="AUTH",
-                name="login_fallido",
-                response_time=total_time,
-                response_length=0,
-                exception=e,
-                context={}
-            )
+        if self.registered:
+            return self.auth_service.iniciar_sesion(self.email, "PasswordIncorrecta123!")
     
     @task(1)  # Peso 1: poco frecuente
+    @timed_task("registro_usuario")
     def registro_nuevo_usuario(self):
         """
         Tarea: Registro de nuevo usuario.
         Menos común que login (peso 1).
         """
-        start_time = events.request.fire.__self__.time()
-        try:
-            # Generar email único
-            nuevo_email = f"new_user_{random.randint(1, 10000000)}@loadtest.com"
-            
-            exito, mensaje = self.auth_service.registrar_usuario(
-                nuevo_email, 
-                "NewUser123!"
-            )
-            
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            
-            if exito:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="registro_usuario",
-                    response_time=total_time,
-                    response_length=len(mensaje),
-                    exception=None,
-                    context={}
-                )
-            else:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="registro_usuario",
-                    response_time=total_time,
-                    response_length=0,
-                    exception=Exception(mensaje),
-                    context={}
-                )
-        except Exception as e:
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            events.request.fire(
-                request_type="AUTH",
-                name="registro_usuario",
-                response_time=total_time,
-                response_length=0,
-                exception=e,
-                context={}
-            )
+        nuevo_email = f"new_user_{_nuevo_uid()}@loadtest.com"
+        return self.auth_service.registrar_usuario(nuevo_email, "NewUser123!")
     
     @task(1)  # Peso 1: poco frecuente
+    @timed_task("validar_email", request_type="VALIDATION", esperado=None)
     def validar_email(self):
         """
         Tarea: Validación de email.
         Operación ligera para medir rendimiento de validaciones (peso 1).
         """
-        start_time = events.request.fire.__self__.time()
-        try:
-            emails_test = [
-                "valido@ejemplo.com",
-                "invalido",
-                f"test_{random.randint(1, 1000)}@test.com"
-            ]
-            email = random.choice(emails_test)
-            
-            valido, mensaje = self.auth_service.validar_email(email)
-            
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            
-            events.request.fire(
-                request_type="VALIDATION",
-                name="validar_email",
-                response_time=total_time,
-                response_length=len(mensaje),
-                exception=None,
-                context={}
-            )
-        except Exception as e:
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            events.request.fire(
-                request_type="VALIDATION",
-                name="validar_email",
-                response_time=total_time,
-                response_length=0,
-                exception=e,
-                context={}
-            )
+        emails_test = [
+            "valido@ejemplo.com",
+            "invalido",
+            f"test_{random.randint(1, 1000)}@test.com"
+        ]
+        return self.auth_service.validar_email(random.choice(emails_test))
     
     @task(1)  # Peso 1: poco frecuente
+    @timed_task("recuperacion_password")
     def solicitar_recuperacion(self):
         """
         Tarea: Solicitar recuperación de contraseña.
         Operación ocasional (peso 1).
         """
-        if not self.registered:
-            return
-        
-        start_time = events.request.fire.__self__.time()
-        try:
-            exito, mensaje = self.auth_service.solicitar_recuperacion_password(
-                self.email
-            )
-            
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            
-            if exito:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="recuperacion_password",
-                    response_time=total_time,
-                    response_length=len(mensaje),
-                    exception=None,
-                    context={}
-                )
-            else:
-                events.request.fire(
-                    request_type="AUTH",
-                    name="recuperacion_password",
-                    response_time=total_time,
-                    response_length=0,
-                    exception=Exception(mensaje),
-                    context={}
-                )
-        except Exception as e:
-            total_time = int((events.request.fire.__self__.time() - start_time) * 1000)
-            events.request.fire(
-                request_type="AUTH",
-                name="recuperacion_password",
-                response_time=total_time,
-                response_length=0,
-                exception=e,
-                context={}
-            )
+        if self.registered:
+            return self.auth_service.solicitar_recuperacion_password(self.email)
 
 
 # ============================================================================
@@ -315,10 +263,15 @@ class PruebasVolumen(AutenticacionUser):
 @events.test_start.add_listener
 def on_test_start(environment, **kwargs):
     """Se ejecuta al iniciar las pruebas."""
+    # En modo interactivo una nueva ejecución reabre la BD cerrada en on_test_stop
+    global _shared_db
+    if _shared_db is None:
+        _shared_db = _abrir_db_compartida(environment)
+    
     print("=" * 60)
     print("INICIANDO PRUEBAS DE RENDIMIENTO")
     print("=" * 60)
-    print(f"Base de datos: data/performance_test.db")
+    print(f"Base de datos: {DB_PATH}")
     print(f"Usuarios concurrentes: {environment.parsed_options.num_users if hasattr(environment, 'parsed_options') else 'N/A'}")
     print("=" * 60)
 
@@ -330,11 +283,16 @@ def on_test_stop(environment, **kwargs):
     print("PRUEBAS DE RENDIMIENTO FINALIZADAS")
     print("=" * 60)
     
-    # Limpiar base de datos de prueba
-    db_path = Path("data/performance_test.db")
-    if db_path.exists():
+    # Cerrar la conexión compartida antes de borrar el archivo
+    global _shared_db
+    if _shared_db is not None:
+        _shared_db.close()
+        _shared_db = None
+    
+    # Limpiar base de datos de prueba (solo el proceso que la creó)
+    if not _es_worker(environment) and Path(DB_PATH).exists():
         try:
-            db_path.unlink()
+            _borrar_archivos_db()
             print("✓ Base de datos de prueba eliminada")
         except:
             print("⚠ No se pudo eliminar la base de datos de prueba")
@@ -3,30 +3,10 @@ Pruebas unitarias para el módulo de servicios de autenticación.
 Cubre validaciones, lógica de negocio y casos límite.
 """
 import pytest
-import sys
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Agregar el directorio raíz al path
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
-from src.auth_service import AuthService
-from src.database import Database
-
-
-@pytest.fixture
-def db_test():
-    """Fixture que crea una base de datos temporal para cada test."""
-    db_path = "data/test_auth_service.db"
-    db = Database(db_path)
-    yield db
-    # Cleanup: eliminar base de datos de prueba
-    Path(db_path).unlink(missing_ok=True)
-
-
-@pytest.fixture
-def auth_service(db_test):
-    """Fixture que crea un servicio de autenticación con BD de prueba."""
-    return AuthService(db_test)
+from src.auth_service import _SmtpPool
 
 
 # ============================================================================
@@ -36,90 +16,33 @@ def auth_service(db_test):
 class TestValidacionEmail:
     """Suite de pruebas para validación de emails."""
     
-    def test_email_valido_basico(self, auth_service):
-        """Debe aceptar un email válido básico."""
-        valido, mensaje = auth_service.validar_email("usuario@ejemplo.com")
-        assert valido is True
-        assert "válido" in mensaje.lower()
-    
-    def test_email_valido_con_numeros(self, auth_service):
-        """Debe aceptar emails con números."""
-        valido, _ = auth_service.validar_email("usuario123@ejemplo.com")
-        assert valido is True
-    
-    def test_email_valido_con_guiones(self, auth_service):
-        """Debe aceptar emails con guiones y guiones bajos."""
-        valido, _ = auth_service.validar_email("usuario-test_123@ejemplo.com")
-        assert valido is True
-    
-    def test_email_valido_con_puntos(self, auth_service):
-        """Debe aceptar emails con puntos en el nombre."""
-        valido, _ = auth_service.validar_email("usuario.nombre@ejemplo.com")
-        assert valido is True
-    
-    def test_email_valido_dominio_largo(self, auth_service):
-        """Debe aceptar emails con dominios largos."""
-        valido, _ = auth_service.validar_email("usuario@ejemplo.co.cr")
-        assert valido is True
-    
-    def test_email_vacio(self, auth_service):
-        """Debe rechazar email vacío."""
-        valido, mensaje = auth_service.validar_email("")
-        assert valido is False
-        assert "vacío" in mensaje.lower()
-    
-    def test_email_solo_espacios(self, auth_service):
-        """Debe rechazar email con solo espacios."""
-        valido, mensaje = auth_service.validar_email("   ")
-        assert valido is False
-        assert "vacío" in mensaje.lower()
-    
-    def test_email_sin_arroba(self, auth_service):
-        """Debe rechazar email sin @."""
-        valido, mensaje = auth_service.validar_email("usuarioejemplo.com")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_sin_dominio(self, auth_service):
-        """Debe rechazar email sin dominio."""
-        valido, mensaje = auth_service.validar_email("usuario@")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_sin_nombre(self, auth_service):
-        """Debe rechazar email sin nombre de usuario."""
-        valido, mensaje = auth_service.validar_email("@ejemplo.com")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_sin_extension(self, auth_service):
-        """Debe rechazar email sin extensión de dominio."""
-        valido, mensaje = auth_service.validar_email("usuario@ejemplo")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_con_espacios(self, auth_service):
-        """Debe rechazar email con espacios."""
-        valido, mensaje = auth_service.validar_email("usuario @ejemplo.com")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_multiple_arrobas(self, auth_service):
-        """Debe rechazar email con múltiples @."""
-        valido, mensaje = auth_service.validar_email("usuario@@ejemplo.com")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_caracteres_especiales_invalidos(self, auth_service):
-        """Debe rechazar email con caracteres especiales inválidos."""
-        valido, mensaje = auth_service.validar_email("usuario$#@ejemplo.com")
-        assert valido is False
-        assert "inválido" in mensaje.lower()
-    
-    def test_email_none(self, auth_service):
-        """Debe rechazar email None."""
-        valido, mensaje = auth_service.validar_email(None)
-        assert valido is False
+    @pytest.mark.parametrize("email, esperado, fragmento", [
+        # Emails válidos
+        pytest.param("usuario@ejemplo.com", True, "válido", id="valido_basico"),
+        pytest.param("usuario123@ejemplo.com", True, None, id="valido_con_numeros"),
+        pytest.param("usuario-test_123@ejemplo.com", True, None, id="valido_con_guiones"),
+        pytest.param("usuario.nombre@ejemplo.com", True, None, id="valido_con_puntos"),
+        pytest.param("usuario@ejemplo.co.cr", True, None, id="valido_dominio_largo"),
+        # Emails vacíos
+        pytest.param("", False, "vacío", id="vacio"),
+        pytest.param("   ", False, "vacío", id="solo_espacios"),
+        pytest.param(None, False, None, id="none"),
+        # Emails con formato inválido
+        pytest.param("usuarioejemplo.com", False, "inválido", id="sin_arroba"),
+        pytest.param("usuario@", False, "inválido", id="sin_dominio"),
+        pytest.param("@ejemplo.com", False, "inválido", id="sin_nombre"),
+        pytest.param("usuario@ejemplo", False, "inválido", id="sin_extension"),
+        pytest.param("usuario @ejemplo.com", False, "inválido", id="con_espacios"),
+        pytest.param("usuario@@ejemplo.com", False, "inválido", id="multiple_arrobas"),
+        pytest.param("usuario$#@ejemplo.com", False, "inválido",
+                     id="caracteres_especiales_invalidos"),
+    ])
+    def test_validar_email(self, auth_service, email, esperado, fragmento):
+        """Cada email debe aceptarse o rechazarse con el mensaje adecuado."""
+        valido, mensaje = auth_service.validar_email(email)
+        assert valido is esperado
+        if fragmento is not None:
+            assert fragmento in mensaje.lower()
 
 
 # ============================================================================
@@ -129,100 +52,42 @@ class TestValidacionEmail:
 class TestValidacionPassword:
     """Suite de pruebas para validación de contraseñas."""
     
-    def test_password_valida_minima(self, auth_service):
-        """Debe aceptar contraseña válida de longitud mínima (5 chars)."""
-        valido, mensaje = auth_service.validar_password("Ab1@x")
-        assert valido is True
-        assert "válida" in mensaje.lower()
-    
-    def test_password_valida_maxima(self, auth_service):
-        """Debe aceptar contraseña válida de longitud máxima (10 chars)."""
-        valido, mensaje = auth_service.validar_password("Abcd123!@#")
-        assert valido is True
-        assert "válida" in mensaje.lower()
-    
-    def test_password_valida_media(self, auth_service):
-        """Debe aceptar contraseña válida de longitud media."""
-        valido, mensaje = auth_service.validar_password("Pass123!")
-        assert valido is True
-    
-    def test_password_todos_especiales_validos(self, auth_service):
-        """Debe aceptar diferentes caracteres especiales."""
-        especiales = "!@#$%^&*()_+-=[]{}|;:',.<>?/\\`~"
-        for char in especiales[:5]:  # Probar algunos
-            valido, _ = auth_service.validar_password(f"Pass1{char}")
-            assert valido is True, f"Falló con carácter especial: {char}"
-    
-    def test_password_vacia(self, auth_service):
-        """Debe rechazar contraseña vacía."""
-        valido, mensaje = auth_service.validar_password("")
-        assert valido is False
-        assert "vacía" in mensaje.lower()
-    
-    def test_password_none(self, auth_service):
-        """Debe rechazar contraseña None."""
-        valido, mensaje = auth_service.validar_password(None)
-        assert valido is False
-        assert "vacía" in mensaje.lower()
-    
-    def test_password_muy_corta(self, auth_service):
-        """Debe rechazar contraseña menor a 5 caracteres."""
-        valido, mensaje = auth_service.validar_password("Ab1!")
-        assert valido is False
-        assert "5 caracteres" in mensaje.lower()
-    
-    def test_password_muy_corta_4_chars(self, auth_service):
-        """Debe rechazar contraseña de 4 caracteres."""
-        valido, mensaje = auth_service.validar_password("Ax1!")
-        assert valido is False
-        assert "5" in mensaje
-    
-    def test_password_muy_larga(self, auth_service):
-        """Debe rechazar contraseña mayor a 10 caracteres."""
-        valido, mensaje = auth_service.validar_password("Password123!")
-        assert valido is False
-        assert "10 caracteres" in mensaje.lower()
-    
-    def test_password_muy_larga_11_chars(self, auth_service):
-        """Debe rechazar contraseña de 11 caracteres."""
-        valido, mensaje = auth_service.validar_password("Password12!")
-        assert valido is False
-        assert "10" in mensaje
-    
-    def test_password_sin_mayuscula(self, auth_service):
-        """Debe rechazar contraseña sin mayúsculas."""
-        valido, mensaje = auth_service.validar_password("pass123!")
-        assert valido is False
-        assert "mayúscula" in mensaje.lower()
-    
-    def test_password_sin_especial(self, auth_service):
-        """Debe rechazar contraseña sin carácter especial."""
-        valido, mensaje = auth_service.validar_password("Pass1234")
-        assert valido is False
-        assert "especial" in mensaje.lower()
-    
-    def test_password_solo_letras_mayusculas(self, auth_service):
-        """Debe rechazar contraseña solo con letras mayúsculas."""
-        valido, mensaje = auth_service.validar_password("PASSWORD")
-        assert valido is False
-        # Falla por falta de especial (o longitud)
-    
-    def test_password_solo_numeros(self, auth_service):
-        """Debe rechazar contraseña solo con números."""
-        valido, mensaje = auth_service.validar_password("12345678")
-        assert valido is False
-    
-    def test_password_espacios(self, auth_service):
-        """Debe aceptar contraseñas con espacios si cumplen requisitos."""
-        valido, _ = auth_service.validar_password("Pass 1!")
+    @pytest.mark.parametrize("password, esperado, fragmento", [
+        # Contraseñas válidas
+        pytest.param("Ab1@x", True, "válida", id="valida_minima"),
+        pytest.param("Abcd123!@#", True, "válida", id="valida_maxima"),
+        pytest.param("Pass123!", True, None, id="valida_media"),
         # Los espacios son válidos en contraseñas
-        assert valido is True
-    
-    def test_password_unicode(self, auth_service):
-        """Debe manejar caracteres unicode en contraseñas."""
-        valido, _ = auth_service.validar_password("Páss1!")
+        pytest.param("Pass 1!", True, None, id="espacios"),
         # La validación actual acepta unicode
-        assert valido is True
+        pytest.param("Páss1!", True, None, id="unicode"),
+        # Contraseñas vacías
+        pytest.param("", False, "vacía", id="vacia"),
+        pytest.param(None, False, "vacía", id="none"),
+        # Longitud fuera de rango
+        pytest.param("Ab1!", False, "5 caracteres", id="muy_corta"),
+        pytest.param("Ax1!", False, "5", id="muy_corta_4_chars"),
+        pytest.param("Password123!", False, "10 caracteres", id="muy_larga"),
+        pytest.param("Password12!", False, "10", id="muy_larga_11_chars"),
+        # Requisitos de caracteres
+        pytest.param("pass123!", False, "mayúscula", id="sin_mayuscula"),
+        pytest.param("Pass1234", False, "especial", id="sin_especial"),
+        # Falla por falta de especial (o longitud)
+        pytest.param("PASSWORD", False, None, id="solo_letras_mayusculas"),
+        pytest.param("12345678", False, None, id="solo_numeros"),
+    ])
+    def test_validar_password(self, auth_service, password, esperado, fragmento):
+        """Cada contraseña debe aceptarse o rechazarse con el mensaje adecuado."""
+        valido, mensaje = auth_service.validar_password(password)
+        assert valido is esperado
+        if fragmento is not None:
+            assert fragmento in mensaje.lower()
+    
+    @pytest.mark.parametrize("char", ["!", "@", "#", "$", "%"])
+    def test_password_todos_especiales_validos(self, auth_service, char):
+        """Debe aceptar diferentes caracteres especiales."""
+        valido, _ = auth_service.validar_password(f"Pass1{char}")
+        assert valido is True, f"Falló con carácter especial: {char}"
 
 
 # ============================================================================
@@ -241,6 +106,14 @@ class TestRegistroUsuario:
         assert exito is True
         assert "exitosamente" in mensaje.lower()
     
+    def test_registro_recorta_espacios_del_email(self, auth_service):
+        """El email se guarda recortado, igual que lo busca el login."""
+        exito, _ = auth_service.registrar_usuario("  espacios@ejemplo.com ", "Pass123!")
+        
+        assert exito is True
+        assert auth_service.db.obtener_usuario("espacios@ejemplo.com") is not None
+        assert auth_service.obtener_intentos_restantes(" espacios@ejemplo.com") == 5
+    
     def test_registro_email_invalido(self, auth_service):
         """Debe fallar registro con email inválido."""
         exito, mensaje = auth_service.registrar_usuario(
@@ -281,9 +154,25 @@ class TestRegistroUsuario:
             ("user3@test.com", "Pass789!")
         ]
         
+        exito, _ = auth_service.registrar_usuarios(usuarios)
+        assert exito is True
+        
         for email, password in usuarios:
-            exito, _ = auth_service.registrar_usuario(email, password)
+            exito, _ = auth_service.iniciar_sesion(email, password)
             assert exito is True
+    
+    def test_registro_multiples_rechaza_lote_con_invalido(self, auth_service):
+        """Si un usuario del lote es inválido no debe registrarse ninguno."""
+        usuarios = [
+            ("lote1@test.com", "Pass123!"),
+            ("lote2@test.com", "corta")
+        ]
+        
+        exito, mensaje = auth_service.registrar_usuarios(usuarios)
+        
+        assert exito is False
+        assert "lote2@test.com" in mensaje
+        assert auth_service.db.obtener_usuario("lote1@test.com") is None
 
 
 # ============================================================================
@@ -293,12 +182,18 @@ class TestRegistroUsuario:
 class TestInicioSesion:
     """Suite de pruebas para el inicio de sesión."""
     
-    @pytest.fixture(autouse=True)
-    def setup_usuario(self, auth_service):
-        """Crea un usuario de prueba antes de cada test."""
-        self.email_test = "login@ejemplo.com"
-        self.password_test = "Pass123!"
-        auth_service.registrar_usuario(self.email_test, self.password_test)
+    @pytest.fixture(scope="class", autouse=True)
+    @classmethod
+    def setup_usuario(cls, auth_service, db_test):
+        """Crea el usuario de prueba una vez para toda la clase."""
+        cls.email_test = "login@ejemplo.com"
+        cls.password_test = "Pass123!"
+        auth_service.registrar_usuario(cls.email_test, cls.password_test)
+        yield
+        # Se creó fuera del savepoint de cada test: hay que borrarlo a mano
+        db_test._get_connection().execute(
+            "DELETE FROM usuarios WHERE email = ?", (cls.email_test,)
+        )
     
     def test_login_exitoso(self, auth_service):
         """Debe permitir login con credenciales correctas."""
@@ -343,6 +238,33 @@ class TestInicioSesion:
         """Debe fallar login con ambos campos vacíos."""
         exito, mensaje = auth_service.iniciar_sesion("", "")
         assert exito is False
+    
+    def test_login_con_estado_reporta_intentos_restantes(self, auth_service):
+        """Debe retornar intentos restantes y bloqueo junto con el resultado."""
+        exito, _, intentos, bloqueado = auth_service.iniciar_sesion_con_estado(
+            self.email_test, 
+            "Incorrecta1!"
+        )
+        assert exito is False
+        assert intentos == 4
+        assert bloqueado is False
+    
+    def test_login_con_estado_usuario_bloqueado(self, auth_service):
+        """Debe indicar bloqueo sin necesidad de otra consulta."""
+        for i in range(5):
+            resultado = auth_service.iniciar_sesion_con_estado(self.email_test, f"Mala{i}!")
+        
+        assert resultado[1] == "Usuario bloqueado por múltiples intentos fallidos"
+        assert resultado[2] == 0
+        assert resultado[3] is True
+    
+    def test_login_email_con_espacios_alrededor(self, auth_service):
+        """Debe ignorar espacios al inicio y final del email en el login."""
+        exito, mensaje = auth_service.iniciar_sesion(
+            f"  {self.email_test}  ", 
+            self.password_test
+        )
+        assert exito is True
 
 
 # ============================================================================
@@ -352,12 +274,18 @@ class TestInicioSesion:
 class TestSistemaIntentos:
     """Suite de pruebas para el sistema de intentos fallidos."""
     
-    @pytest.fixture(autouse=True)
-    def setup_usuario(self, auth_service):
-        """Crea un usuario de prueba."""
-        self.email_test = "intentos@ejemplo.com"
-        self.password_test = "Pass123!"
-        auth_service.registrar_usuario(self.email_test, self.password_test)
+    @pytest.fixture(scope="class", autouse=True)
+    @classmethod
+    def setup_usuario(cls, auth_service, db_test):
+        """Crea el usuario de prueba una vez para toda la clase."""
+        cls.email_test = "intentos@ejemplo.com"
+        cls.password_test = "Pass123!"
+        auth_service.registrar_usuario(cls.email_test, cls.password_test)
+        yield
+        # Se creó fuera del savepoint de cada test: hay que borrarlo a mano
+        db_test._get_connection().execute(
+            "DELETE FROM usuarios WHERE email = ?", (cls.email_test,)
+        )
     
     def test_intentos_restantes_inicial(self, auth_service):
         """Usuario nuevo debe tener 5 intentos disponibles."""
@@ -400,8 +328,7 @@ class TestSistemaIntentos:
     def test_login_bloqueado_rechaza_password_correcta(self, auth_service):
         """Usuario bloqueado no puede hacer login ni con password correcta."""
         # Bloquear usuario
-        for i in range(5):
-            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        auth_service.db.bloquear_usuario(self.email_test)
         
         # Intentar con password correcta
         exito, mensaje = auth_service.iniciar_sesion(
@@ -414,11 +341,48 @@ class TestSistemaIntentos:
     def test_intentos_restantes_cero_cuando_bloqueado(self, auth_service):
         """Intentos restantes debe ser 0 cuando está bloqueado."""
         # Bloquear
-        for i in range(5):
-            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        auth_service.db.bloquear_usuario(self.email_test)
         
         intentos = auth_service.obtener_intentos_restantes(self.email_test)
         assert intentos == 0
+    
+    def test_fuerza_bruta_no_hashea_tras_agotar_intentos(self, auth_service):
+        """Con la cuenta bloqueada el login se rechaza sin ejecutar bcrypt."""
+        for i in range(5):
+            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        
+        with mock.patch("src.database.bcrypt.checkpw") as checkpw:
+            exito, mensaje = auth_service.iniciar_sesion(self.email_test, "Otra123!")
+        
+        assert exito is False
+        assert "bloqueado" in mensaje.lower()
+        checkpw.assert_not_called()
+    
+    def test_desbloqueo_en_bd_permite_login(self, auth_service):
+        """Un desbloqueo hecho directo en la BD debe permitir volver a entrar."""
+        for i in range(5):
+            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        
+        exito_desbloqueo, _ = auth_service.db.desbloquear_usuario(self.email_test)
+        assert exito_desbloqueo is True
+        
+        exito, mensaje, restantes, bloqueado = auth_service.iniciar_sesion_con_estado(
+            self.email_test, self.password_test
+        )
+        assert exito is True, mensaje
+        assert bloqueado is False
+        assert restantes == 5
+    
+    def test_cambiar_password_permite_login_tras_bloqueo(self, auth_service, emitir_token):
+        """Tras cambiar la contraseña el usuario vuelve a poder iniciar sesión."""
+        for i in range(5):
+            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        
+        token = emitir_token(self.email_test)
+        auth_service.cambiar_password(self.email_test, token, "Nueva123!")
+        
+        exito, _ = auth_service.iniciar_sesion(self.email_test, "Nueva123!")
+        assert exito is True
 
 
 # ============================================================================
@@ -428,12 +392,18 @@ class TestSistemaIntentos:
 class TestRecuperacionPassword:
     """Suite de pruebas para recuperación de contraseña."""
     
-    @pytest.fixture(autouse=True)
-    def setup_usuario(self, auth_service):
-        """Crea un usuario de prueba."""
-        self.email_test = "recuperacion@ejemplo.com"
-        self.password_test = "Pass123!"
-        auth_service.registrar_usuario(self.email_test, self.password_test)
+    @pytest.fixture(scope="class", autouse=True)
+    @classmethod
+    def setup_usuario(cls, auth_service, db_test):
+        """Crea el usuario de prueba una vez para toda la clase."""
+        cls.email_test = "recuperacion@ejemplo.com"
+        cls.password_test = "Pass123!"
+        auth_service.registrar_usuario(cls.email_test, cls.password_test)
+        yield
+        # Se creó fuera del savepoint de cada test: hay que borrarlo a mano
+        db_test._get_connection().execute(
+            "DELETE FROM usuarios WHERE email = ?", (cls.email_test,)
+        )
     
     def test_generar_token_recuperacion(self, auth_service):
         """Debe generar un token de recuperación."""
@@ -455,6 +425,17 @@ class TestRecuperacionPassword:
         assert exito is True
         assert "token" in mensaje.lower() or "generado" in mensaje.lower()
     
+    def test_solicitar_recuperacion_reutiliza_usuario_consultado(self, auth_service):
+        """Si se pasa el usuario ya consultado no debe volver a leerlo."""
+        usuario = auth_service.db.obtener_usuario(self.email_test)
+        with mock.patch.object(auth_service.db, "obtener_usuario") as obtener_mock:
+            exito, _ = auth_service.solicitar_recuperacion_password(
+                self.email_test, usuario=usuario
+            )
+        
+        assert exito is True
+        obtener_mock.assert_not_called()
+    
     def test_solicitar_recuperacion_usuario_inexistente(self, auth_service):
         """Debe fallar recuperación para usuario inexistente."""
         exito, mensaje = auth_service.solicitar_recuperacion_password(
@@ -463,11 +444,12 @@ class TestRecuperacionPassword:
         assert exito is False
         assert "no" in mensaje.lower() and "registrado" in mensaje.lower()
     
-    def test_cambiar_password_exitoso(self, auth_service):
+    def test_cambiar_password_exitoso(self, auth_service, emitir_token):
         """Debe permitir cambiar contraseña con validaciones."""
         nueva_password = "Nueva123!"
         exito, mensaje = auth_service.cambiar_password(
             self.email_test, 
+            emitir_token(self.email_test),
             nueva_password
         )
         assert exito is True
@@ -480,28 +462,70 @@ class TestRecuperacionPassword:
         )
         assert exito_login is True
     
-    def test_cambiar_password_invalida(self, auth_service):
+    def test_cambiar_password_invalida(self, auth_service, emitir_token):
         """Debe rechazar cambio a contraseña inválida."""
         exito, mensaje = auth_service.cambiar_password(
             self.email_test, 
+            emitir_token(self.email_test),
             "corta"
         )
         assert exito is False
         assert "contraseña" in mensaje.lower()
     
-    def test_cambiar_password_desbloquea_usuario(self, auth_service):
+    def test_cambiar_password_sin_token_falla(self, auth_service):
+        """Debe rechazar el cambio si no se presenta un token."""
+        exito, mensaje = auth_service.cambiar_password(self.email_test, "", "Nueva123!")
+        
+        assert exito is False
+        assert "token" in mensaje.lower()
+        assert auth_service.iniciar_sesion(self.email_test, "Nueva123!")[0] is False
+    
+    def test_cambiar_password_desbloquea_usuario(self, auth_service, emitir_token):
         """Cambiar contraseña debe desbloquear usuario bloqueado."""
         # Bloquear usuario
-        for i in range(5):
-            auth_service.iniciar_sesion(self.email_test, f"Incorrecta{i}!")
+        auth_service.db.bloquear_usuario(self.email_test)
         
         assert auth_service.usuario_esta_bloqueado(self.email_test) is True
         
         # Cambiar contraseña
-        auth_service.cambiar_password(self.email_test, "Nueva123!")
+        token = emitir_token(self.email_test)
+        auth_service.cambiar_password(self.email_test, token, "Nueva123!")
         
         # Verificar que se desbloqueó
         assert auth_service.usuario_esta_bloqueado(self.email_test) is False
+    
+    def test_pool_smtp_reutiliza_conexion(self):
+        """Varios envíos al mismo servidor deben autenticarse una sola vez."""
+        pool = _SmtpPool()
+        with mock.patch("src.auth_service.smtplib.SMTP") as smtp_mock:
+            for _ in range(3):
+                pool.send("dest@test.com", b"mensaje", "smtp.test.com", 587, "user", "clave")
+            
+            smtp_mock.assert_called_once_with("smtp.test.com", 587)
+            conexion = smtp_mock.return_value
+            conexion.login.assert_called_once_with("user", "clave")
+            assert conexion.sendmail.call_count == 3
+            pool.cerrar()
+    
+    def test_solicitar_recuperacion_envia_email_en_segundo_plano(self, auth_service):
+        """Con SMTP configurado debe retornar sin esperar el envío del email."""
+        # Executor propio para poder esperarlo sin apagar el del servicio compartido
+        executor = ThreadPoolExecutor(max_workers=1)
+        with mock.patch.object(
+            auth_service, "_enviar_email_recuperacion", return_value=True
+        ) as enviar_mock, mock.patch.object(auth_service, "_smtp_executor", executor):
+            exito, mensaje = auth_service.solicitar_recuperacion_password(
+                self.email_test,
+                smtp_server="smtp.test.com",
+                smtp_user="user",
+                smtp_password="clave"
+            )
+            executor.shutdown(wait=True)
+        
+        assert exito is True
+        assert "en proceso" in mensaje.lower()
+        enviar_mock.assert_called_once()
+        assert enviar_mock.call_args.args[0] == self.email_test
 
 
 # ============================================================================
@@ -518,6 +542,24 @@ class TestCasosLimite:
         # Debe validar el formato (incluso si es largo)
         assert valido is True
     
+    def test_email_mayor_a_254_caracteres_invalido(self, auth_service):
+        """Debe rechazar emails más largos que el máximo de RFC 5321."""
+        local = "a" * 64
+        email_limite = local + "@" + "b" * (254 - 64 - 5) + ".com"
+        assert len(email_limite) == 254
+        
+        assert auth_service.validar_email(email_limite)[0] is True
+        valido, mensaje = auth_service.validar_email("c" + email_limite)
+        assert valido is False
+        assert "inválido" in mensaje.lower()
+    
+    def test_email_dominio_largo_invalido(self, auth_service):
+        """Debe rechazar dominios largos con muchos puntos sin extensión válida."""
+        email = "usuario@" + "a." * 5000 + "c1"
+        valido, mensaje = auth_service.validar_email(email)
+        assert valido is False
+        assert "inválido" in mensaje.lower()
+    
     def test_password_con_caracteres_raros(self, auth_service):
         """Debe manejar contraseñas con emojis y unicode."""
         # Con emoji (si tiene 5-10 chars, mayúscula y especial)
@@ -551,7 +593,7 @@ class TestCasosLimite:
 class TestIntegracionMetodos:
     """Pruebas que verifican la interacción entre múltiples métodos."""
     
-    def test_flujo_completo_usuario(self, auth_service):
+    def test_flujo_completo_usuario(self, auth_service, emitir_token):
         """Flujo completo: registro → login → recuperación → cambio."""
         email = "flujo@test.com"
         
@@ -564,11 +606,10 @@ class TestIntegracionMetodos:
         assert exito is True
         
         # 3. Solicitar recuperación
-        exito, _ = auth_service.solicitar_recuperacion_password(email)
-        assert exito is True
+        token = emitir_token(email)
         
         # 4. Cambiar contraseña
-        exito, _ = auth_service.cambiar_password(email, "Nueva456!")
+        exito, _ = auth_service.cambiar_password(email, token, "Nueva456!")
         assert exito is True
         
         # 5. Login con nueva contraseña
@@ -2,25 +2,14 @@
 Pruebas unitarias para el módulo de base de datos.
 Cubre operaciones CRUD, hashing, integridad y persistencia.
 """
+import hashlib
 import pytest
-import sys
 from pathlib import Path
 import sqlite3
-
-# Agregar el directorio raíz al path
-sys.path.insert(0, str(Path(__file__).parent.parent))
+import time
 
 from src.database import Database
-
-
-@pytest.fixture
-def db_test():
-    """Fixture que crea una base de datos temporal para cada test."""
-    db_path = "data/test_database.db"
-    db = Database(db_path)
-    yield db
-    # Cleanup: eliminar base de datos de prueba
-    Path(db_path).unlink(missing_ok=True)
+from tests import RONDAS_BCRYPT
 
 
 # ============================================================================
@@ -30,9 +19,48 @@ def db_test():
 class TestEstructuraBaseDatos:
     """Pruebas de la estructura y creación de la base de datos."""
     
-    def test_crear_base_datos(self, db_test):
+    def test_crear_base_datos(self, tmp_path):
         """Debe crear el archivo de base de datos."""
-        assert Path(db_test.db_path).exists()
+        db_path = tmp_path / "test_creacion.db"
+        db = Database(str(db_path), rondas_bcrypt=RONDAS_BCRYPT)
+        try:
+            assert db_path.exists()
+        finally:
+            db.close()
+    
+    def test_uri_memoria_compartida(self):
+        """Dos instancias sobre la misma URI en memoria deben ver los mismos datos."""
+        uri = "file:test_compartida?mode=memory&cache=shared"
+        db1 = Database(uri, rondas_bcrypt=RONDAS_BCRYPT)
+        db2 = Database(uri, rondas_bcrypt=RONDAS_BCRYPT)
+        try:
+            db1.crear_usuario("compartido@ejemplo.com", "Pass123!")
+            assert db2.obtener_usuario("compartido@ejemplo.com") is not None
+        finally:
+            db2.close()
+            db1.close()
+    
+    def test_pragmas_de_rendimiento(self, tmp_path):
+        """Debe abrir la conexión con WAL, synchronous=NORMAL y temporales en RAM."""
+        db = Database(str(tmp_path / "test_pragmas.db"), rondas_bcrypt=RONDAS_BCRYPT)
+        try:
+            conn = db._get_connection()
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -20000
+        finally:
+            db.close()
+    
+    def test_crear_base_datos_en_memoria(self):
+        """Debe aceptar ':memory:' sin crear archivos ni directorios."""
+        db = Database(":memory:", rondas_bcrypt=RONDAS_BCRYPT)
+        try:
+            exito, _ = db.crear_usuario("memoria@ejemplo.com", "Pass123!")
+            assert exito is True
+            assert not Path(":memory:").exists()
+        finally:
+            db.close()
     
     def test_tabla_usuarios_existe(self, db_test):
         """Debe crear la tabla usuarios."""
@@ -43,7 +71,6 @@ class TestEstructuraBaseDatos:
             WHERE type='table' AND name='usuarios'
         """)
         resultado = cursor.fetchone()
-        conn.close()
         
         assert resultado is not None
         assert resultado[0] == 'usuarios'
@@ -57,18 +84,38 @@ class TestEstructuraBaseDatos:
             WHERE type='table' AND name='recovery_tokens'
         """)
         resultado = cursor.fetchone()
-        conn.close()
         
         assert resultado is not None
         assert resultado[0] == 'recovery_tokens'
     
+    def test_indice_verificacion_cubre_consulta(self, db_test):
+        """La lectura de credenciales debe resolverse solo con el índice."""
+        from src.database import _SQL_ESTADO_CREDENCIALES
+        conn = db_test._get_connection()
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + _SQL_ESTADO_CREDENCIALES,
+            ("x@ejemplo.com",)
+        ).fetchall()
+        
+        assert "COVERING INDEX idx_usuarios_verify" in plan[0][3]
+    
+    def test_obtener_usuario_busca_por_indice(self, db_test):
+        """La búsqueda por email debe usar el índice UNIQUE, no un recorrido."""
+        from src.database import _SQL_OBTENER_USUARIO
+        conn = db_test._get_connection()
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN " + _SQL_OBTENER_USUARIO,
+            ("x@ejemplo.com",)
+        ).fetchall()
+        
+        assert plan[0][3].startswith("SEARCH usuarios USING INDEX")
+    
     def test_columnas_tabla_usuarios(self, db_test):
         """Debe tener todas las columnas necesarias en usuarios."""
         conn = db_test._get_connection()
         cursor = conn.cursor()
         cursor.execute("PRAGMA table_info(usuarios)")
         columnas = {row[1] for row in cursor.fetchall()}
-        conn.close()
         
         columnas_requeridas = {
             'id', 'email', 'password_hash', 'fecha_creacion',
@@ -91,13 +138,15 @@ class TestHashingPasswords:
         
         assert hash_resultado != password
     
-    def test_hash_es_determinista(self, db_test):
-        """Mismo password debe generar mismo hash."""
+    def test_hash_lleva_sal_aleatoria(self, db_test):
+        """Mismo password debe generar hashes distintos que verifican ambos."""
         password = "MiPassword123!"
         hash1 = db_test._hash_password(password)
         hash2 = db_test._hash_password(password)
         
-        assert hash1 == hash2
+        assert hash1 != hash2
+        assert db_test._verificar_password(password, hash1) is True
+        assert db_test._verificar_password(password, hash2) is True
     
     def test_hash_diferente_para_passwords_diferentes(self, db_test):
         """Passwords diferentes deben generar hashes diferentes."""
@@ -105,27 +154,66 @@ class TestHashingPasswords:
         hash2 = db_test._hash_password("Password2!")
         
         assert hash1 != hash2
+        assert db_test._verificar_password("Password2!", hash1) is False
     
     def test_hash_longitud_consistente(self, db_test):
-        """Todos los hashes deben tener la misma longitud (SHA-256)."""
-        passwords = ["short", "medium_password", "very_long_password_here"]
+        """Todos los hashes deben tener la misma longitud (bcrypt)."""
+        passwords = ["short", "medium_password", "very_long_password_here" * 10]
         hashes = [db_test._hash_password(p) for p in passwords]
         
-        # SHA-256 en hex = 64 caracteres
-        assert all(len(h) == 64 for h in hashes)
+        # Formato modular de bcrypt = 60 caracteres
+        assert all(len(h) == 60 for h in hashes)
     
-    def test_hash_solo_caracteres_hexadecimales(self, db_test):
-        """El hash debe contener solo caracteres hexadecimales."""
+    def test_hash_formato_bcrypt_con_rondas_configuradas(self, db_test):
+        """El hash debe ser bcrypt con el costo indicado al crear la BD."""
         hash_resultado = db_test._hash_password("Test123!")
         
-        # Verificar que es hexadecimal válido
+        assert hash_resultado.startswith(f"$2b${RONDAS_BCRYPT:02d}$")
+    
+    def test_password_larga_no_se_trunca(self, db_test):
+        """bcrypt corta en 72 bytes: el prehash debe distinguir el resto."""
+        base = "A!" + "x" * 80
+        hash_resultado = db_test._hash_password(base + "1")
+        
+        assert db_test._verificar_password(base + "2", hash_resultado) is False
+    
+    def test_hashes_heredados_se_envuelven_al_abrir(self, tmp_path):
+        """Al abrir la BD los hashes SHA-256 sin sal deben quedar envueltos en bcrypt."""
+        ruta = str(tmp_path / "heredada.db")
+        email = "heredado@ejemplo.com"
+        password = "Compatible123!"
+        db = Database(ruta, rondas_bcrypt=RONDAS_BCRYPT)
+        db._get_connection().execute(
+            "INSERT INTO usuarios (email, password_hash, fecha_creacion) VALUES (?, ?, ?)",
+            (email, hashlib.sha256(password.encode()).hexdigest(), "2024-01-01T00:00:00")
+        )
+        db.close()
+        
+        db = Database(ruta, rondas_bcrypt=RONDAS_BCRYPT)
         try:
-            int(hash_resultado, 16)
-            es_hex = True
-        except ValueError:
-            es_hex = False
+            guardado = db._get_connection().execute(
+                "SELECT password_hash FROM usuarios WHERE email = ?", (email,)
+            ).fetchone()[0]
+            
+            # Sin ningún login de por medio
+            assert guardado.startswith(f"$2b${RONDAS_BCRYPT:02d}$")
+            assert db.verificar_credenciales(email, password)[0] is True
+            assert db.verificar_credenciales(email, "Otra123!")[0] is False
+        finally:
+            db.close()
+    
+    def test_hash_heredado_en_crudo_ya_no_verifica(self, db_test):
+        """Sin la ruta de SHA-256 sin sal, un digest crudo nunca es un hash válido."""
+        heredado = hashlib.sha256("Compatible123!".encode()).hexdigest()
+        
+        with pytest.raises(ValueError):
+            db_test._verificar_password("Compatible123!", heredado)
+    
+    def test_calibracion_respeta_limites(self):
+        """Las rondas calibradas deben quedar dentro del rango permitido."""
+        from src.database import _calibrar_rondas_bcrypt, _BCRYPT_RONDAS_MIN, _BCRYPT_RONDAS_MAX
         
-        assert es_hex is True
+        assert _BCRYPT_RONDAS_MIN <= _calibrar_rondas_bcrypt() <= _BCRYPT_RONDAS_MAX
 
 
 # ============================================================================
@@ -169,7 +257,6 @@ class TestCrearUsuario:
             (email,)
         )
         resultado = cursor.fetchone()
-        conn.close()
         
         assert resultado is not None
         assert resultado['password_hash'] != password
@@ -211,6 +298,30 @@ class TestCrearUsuario:
         usuario = db_test.obtener_usuario(email)
         assert usuario['fecha_creacion'] is not None
         assert len(usuario['fecha_creacion']) > 0
+    
+    def test_crear_usuarios_en_lote(self, db_test):
+        """Debe crear todos los usuarios del lote."""
+        exito, _ = db_test.crear_usuarios([
+            ("lote1@ejemplo.com", "Pass123!"),
+            ("lote2@ejemplo.com", "Pass456!")
+        ])
+        
+        assert exito is True
+        assert db_test.obtener_usuario("lote1@ejemplo.com") is not None
+        assert db_test.obtener_usuario("lote2@ejemplo.com") is not None
+    
+    def test_crear_usuarios_duplicado_no_crea_ninguno(self, db_test):
+        """Un email repetido debe deshacer el lote completo."""
+        db_test.crear_usuario("existente@ejemplo.com", "Pass123!")
+        
+        exito, mensaje = db_test.crear_usuarios([
+            ("nuevo@ejemplo.com", "Pass123!"),
+            ("existente@ejemplo.com", "Pass456!")
+        ])
+        
+        assert exito is False
+        assert "ya está registrado" in mensaje
+        assert db_test.obtener_usuario("nuevo@ejemplo.com") is None
 
 
 # ============================================================================
@@ -256,6 +367,43 @@ class TestObtenerUsuario:
         
         # No debe incluir password_hash en el resultado
         assert 'password_hash' not in usuario
+    
+    def test_obtener_usuario_refleja_cambios_posteriores(self, db_test):
+        """La lectura en caché debe invalidarse al modificar el usuario."""
+        email = "cache@ejemplo.com"
+        db_test.crear_usuario(email, "Pass123!")
+        
+        # Primera lectura (queda en caché)
+        assert db_test.obtener_usuario(email)['intentos_fallidos'] == 0
+        
+        db_test.verificar_credenciales(email, "Incorrecta!")
+        assert db_test.obtener_usuario(email)['intentos_fallidos'] == 1
+        
+        db_test.desbloquear_usuario(email)
+        assert db_test.obtener_usuario(email)['intentos_fallidos'] == 0
+    
+    def test_obtener_estado_usuario(self, db_test):
+        """Debe retornar (bloqueado, intentos_fallidos) sin el resto de datos."""
+        email = "estado@ejemplo.com"
+        db_test.crear_usuario(email, "Pass123!")
+        db_test.verificar_credenciales(email, "Incorrecta!")
+        
+        assert db_test.obtener_estado_usuario(email) == (False, 1)
+        assert db_test.obtener_estado_usuario("noexiste@ejemplo.com") is None
+    
+    def test_usuarios_existen(self, db_test):
+        """Debe retornar solo los emails registrados, en una sola consulta."""
+        db_test.crear_usuarios([
+            ("uno@ejemplo.com", "Pass123!"),
+            ("dos@ejemplo.com", "Pass456!")
+        ])
+        
+        existentes = db_test.usuarios_existen(
+            ["uno@ejemplo.com", "dos@ejemplo.com", "noexiste@ejemplo.com"]
+        )
+        
+        assert existentes == {"uno@ejemplo.com", "dos@ejemplo.com"}
+        assert db_test.usuarios_existen([]) == set()
 
 
 # ============================================================================
@@ -304,11 +452,11 @@ class TestVerificarCredenciales:
     
     def test_verificar_incrementa_intentos_fallidos(self, db_test):
         """Credenciales incorrectas deben incrementar intentos."""
-        # Intento fallido
-        db_test.verificar_credenciales(self.email, "Incorrecta!")
+        # Intento fallido: el UPDATE ... RETURNING ya trae el estado nuevo
+        _, _, estado = db_test.verificar_credenciales_con_estado(self.email, "Incorrecta!")
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['intentos_fallidos'] == 1
+        assert estado.intentos_fallidos == 1
+        assert db_test.obtener_estado_usuario(self.email) == estado
     
     def test_verificar_resetea_intentos_en_exito(self, db_test):
         """Login exitoso debe resetear intentos fallidos."""
@@ -319,23 +467,61 @@ class TestVerificarCredenciales:
         # Login exitoso
         db_test.verificar_credenciales(self.email, self.password)
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['intentos_fallidos'] == 0
+        assert db_test.obtener_estado_usuario(self.email).intentos_fallidos == 0
     
     def test_verificar_bloquea_despues_5_intentos(self, db_test):
         """Debe bloquear usuario después de 5 intentos fallidos."""
         # 5 intentos fallidos
         for i in range(5):
+            _, _, estado = db_test.verificar_credenciales_con_estado(
+                self.email, f"Incorrecta{i}!"
+            )
+        
+        assert estado.bloqueado is True
+        assert db_test.obtener_estado_usuario(self.email).bloqueado is True
+        assert db_test.obtener_usuario(self.email)['bloqueado'] == 1
+    
+    def test_lote_confirma_bloqueo_al_salir(self, db_test):
+        """Los 5 fallos hechos dentro de lote() deben dejar el bloqueo escrito."""
+        # 5 intentos fallidos, confirmados con un solo commit
+        with db_test.lote():
+            for i in range(5):
+                db_test.verificar_credenciales(self.email, f"Incorrecta{i}!")
+        
+        assert db_test.obtener_estado_usuario(self.email) == (True, 5)
+        fila = db_test._get_connection().execute(
+            "SELECT bloqueado FROM usuarios WHERE email = ?", (self.email,)
+        ).fetchone()
+        assert fila['bloqueado'] == 1
+    
+    def test_quinto_fallo_informa_bloqueo(self, db_test):
+        """El intento que bloquea debe decirlo, no informar 0 intentos restantes."""
+        for i in range(4):
             db_test.verificar_credenciales(self.email, f"Incorrecta{i}!")
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['bloqueado'] == 1
+        exito, mensaje, estado = db_test.verificar_credenciales_con_estado(
+            self.email, "Incorrecta4!"
+        )
+        
+        assert exito is False
+        assert mensaje == "Usuario bloqueado por múltiples intentos fallidos"
+        assert estado == (True, 5)
+    
+    def test_lote_deshace_todo_si_falla(self, db_test):
+        """Una excepción dentro de lote() debe deshacer todas sus escrituras."""
+        with pytest.raises(RuntimeError):
+            with db_test.lote():
+                db_test.verificar_credenciales(self.email, "Incorrecta!")
+                db_test.crear_usuario("en_lote@ejemplo.com", "Pass123!")
+                assert db_test.obtener_usuario("en_lote@ejemplo.com") is not None
+                raise RuntimeError("fallo a mitad del lote")
+        
+        assert db_test.obtener_usuario("en_lote@ejemplo.com") is None
+        assert db_test.obtener_usuario(self.email)['intentos_fallidos'] == 0
     
     def test_verificar_rechaza_usuario_bloqueado(self, db_test):
         """Usuario bloqueado no puede hacer login."""
-        # Bloquear usuario
-        for i in range(5):
-            db_test.verificar_credenciales(self.email, f"Incorrecta{i}!")
+        db_test.bloquear_usuario(self.email)
         
         # Intentar con password correcta
         exito, mensaje = db_test.verificar_credenciales(
@@ -359,11 +545,75 @@ class TestVerificarCredenciales:
             (self.email,)
         )
         resultado = cursor.fetchone()
-        conn.close()
         
         assert resultado['ultimo_intento'] is not None
 
 
+class TestIntentosDiferidos:
+    """Pruebas del modo que acumula intentos fallidos en memoria."""
+    
+    @pytest.fixture
+    def db_diferido(self, tmp_path):
+        """Base de datos con escritura diferida de intentos fallidos."""
+        db = Database(
+            str(tmp_path / "test_diferido.db"), diferir_intentos=True, rondas_bcrypt=RONDAS_BCRYPT
+        )
+        db.crear_usuario("diferido@test.com", "Pass123!")
+        yield db
+        db.close()
+    
+    def _intentos_en_disco(self, db):
+        """Lee (intentos_fallidos, bloqueado) directamente de la tabla."""
+        cursor = db._get_connection().execute(
+            "SELECT intentos_fallidos, bloqueado FROM usuarios WHERE email = ?",
+            ("diferido@test.com",)
+        )
+        return tuple(cursor.fetchone())
+    
+    def test_fallo_se_acumula_en_memoria(self, db_diferido):
+        """El intento fallido se ve en obtener_usuario pero aún no en disco."""
+        exito, mensaje = db_diferido.verificar_credenciales("diferido@test.com", "Mala1!")
+        
+        assert exito is False
+        assert "Intentos restantes: 4" in mensaje
+        assert db_diferido.obtener_usuario("diferido@test.com")['intentos_fallidos'] == 1
+        assert self._intentos_en_disco(db_diferido) == (0, 0)
+    
+    def test_flush_escribe_intentos_pendientes(self, db_diferido):
+        """El flush persiste en lote los intentos acumulados."""
+        for _ in range(3):
+            db_diferido.verificar_credenciales("diferido@test.com", "Mala1!")
+        
+        db_diferido._flush_intentos()
+        
+        assert self._intentos_en_disco(db_diferido) == (3, 0)
+    
+    def test_bloqueo_se_persiste_inmediatamente(self, db_diferido):
+        """El quinto fallo bloquea al usuario en disco sin esperar al flush."""
+        for _ in range(4):
+            db_diferido.verificar_credenciales("diferido@test.com", "Mala1!")
+        
+        exito, mensaje = db_diferido.verificar_credenciales("diferido@test.com", "Mala1!")
+        assert exito is False
+        assert mensaje == "Usuario bloqueado por múltiples intentos fallidos"
+        
+        assert self._intentos_en_disco(db_diferido) == (5, 1)
+        exito, mensaje = db_diferido.verificar_credenciales("diferido@test.com", "Pass123!")
+        assert exito is False
+        assert "bloqueado" in mensaje.lower()
+    
+    def test_login_exitoso_descarta_pendientes(self, db_diferido):
+        """Un login exitoso reinicia el contador aunque haya fallos pendientes."""
+        for _ in range(3):
+            db_diferido.verificar_credenciales("diferido@test.com", "Mala1!")
+        
+        exito, _ = db_diferido.verificar_credenciales("diferido@test.com", "Pass123!")
+        db_diferido._flush_intentos()
+        
+        assert exito is True
+        assert self._intentos_en_disco(db_diferido) == (0, 0)
+
+
 # ============================================================================
 # PRUEBAS DE ACTUALIZACIÓN (UPDATE)
 # ============================================================================
@@ -416,20 +666,16 @@ class TestCambiarPassword:
         # Cambiar password
         db_test.cambiar_password(self.email, "Nueva456!")
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['intentos_fallidos'] == 0
+        assert db_test.obtener_estado_usuario(self.email).intentos_fallidos == 0
     
     def test_cambiar_password_desbloquea_usuario(self, db_test):
         """Cambiar password debe desbloquear usuario bloqueado."""
-        # Bloquear usuario
-        for i in range(5):
-            db_test.verificar_credenciales(self.email, f"Incorrecta{i}!")
+        db_test.bloquear_usuario(self.email)
         
         # Cambiar password
         db_test.cambiar_password(self.email, "Nueva456!")
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['bloqueado'] == 0
+        assert db_test.obtener_estado_usuario(self.email).bloqueado is False
     
     def test_cambiar_password_usuario_inexistente(self, db_test):
         """Debe fallar al cambiar password de usuario inexistente."""
@@ -450,10 +696,7 @@ class TestDesbloquearUsuario:
         """Crea y bloquea un usuario de prueba."""
         self.email = "bloqueado@ejemplo.com"
         db_test.crear_usuario(self.email, "Pass123!")
-        
-        # Bloquear usuario
-        for i in range(5):
-            db_test.verificar_credenciales(self.email, f"Incorrecta{i}!")
+        db_test.bloquear_usuario(self.email)
     
     def test_desbloquear_usuario_exitoso(self, db_test):
         """Debe desbloquear usuario correctamente."""
@@ -466,15 +709,15 @@ class TestDesbloquearUsuario:
         """Debe poner bloqueado en 0."""
         db_test.desbloquear_usuario(self.email)
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['bloqueado'] == 0
+        estado = db_test.obtener_estado_usuario(self.email)
+        assert estado.bloqueado is False
     
     def test_desbloquear_resetea_intentos(self, db_test):
         """Debe resetear intentos fallidos."""
         db_test.desbloquear_usuario(self.email)
         
-        usuario = db_test.obtener_usuario(self.email)
-        assert usuario['intentos_fallidos'] == 0
+        estado = db_test.obtener_estado_usuario(self.email)
+        assert estado.intentos_fallidos == 0
     
     def test_desbloquear_permite_login(self, db_test):
         """Usuario desbloqueado debe poder hacer login."""
@@ -490,6 +733,26 @@ class TestDesbloquearUsuario:
         
         assert exito is False
         assert "no encontrado" in mensaje.lower()
+    
+    def test_bloquear_usuario_equivale_a_agotar_intentos(self, db_test):
+        """bloquear_usuario debe dejar el mismo estado que 5 intentos fallidos."""
+        db_test.crear_usuario("directo@ejemplo.com", "Pass123!")
+        db_test.crear_usuario("fallos@ejemplo.com", "Pass123!")
+        for i in range(5):
+            db_test.verificar_credenciales("fallos@ejemplo.com", f"Incorrecta{i}!")
+        
+        exito, _ = db_test.bloquear_usuario("directo@ejemplo.com")
+        
+        assert exito is True
+        assert db_test.obtener_estado_usuario("directo@ejemplo.com") == \
+            db_test.obtener_estado_usuario("fallos@ejemplo.com")
+    
+    def test_bloquear_usuario_inexistente(self, db_test):
+        """Debe fallar al bloquear usuario inexistente."""
+        exito, mensaje = db_test.bloquear_usuario("noexiste@ejemplo.com")
+        
+        assert exito is False
+        assert "no encontrado" in mensaje.lower()
 
 
 # ============================================================================
@@ -505,6 +768,23 @@ class TestRecoveryTokens:
         self.email = "recovery@ejemplo.com"
         db_test.crear_usuario(self.email, "Pass123!")
     
+    def test_vigencia_de_token_no_depende_de_la_hora_local(self, db_test, monkeypatch):
+        """Un salto de la hora local (cambio de horario) no debe expirar el token."""
+        db_test.crear_token_recuperacion(self.email, "token-utc")
+        
+        # La hora local se adelanta cinco horas; el instante UTC es el mismo
+        monkeypatch.setenv("TZ", "XXX-5")
+        time.tzset()
+        try:
+            exito, mensaje = db_test.cambiar_password_con_token(
+                self.email, "token-utc", "Nueva123!"
+            )
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+        
+        assert exito is True, mensaje
+    
     def test_crear_token_recuperacion(self, db_test):
         """Debe crear un token de recuperación."""
         token = "abc123def456"
@@ -526,7 +806,6 @@ class TestRecoveryTokens:
             WHERE email = ? AND token = ?
         """, (self.email, token))
         resultado = cursor.fetchone()
-        conn.close()
         
         assert resultado is not None
         assert resultado['token'] == token
@@ -541,6 +820,56 @@ class TestRecoveryTokens:
         
         assert exito1 is True
         assert exito2 is True
+    
+    def test_cambiar_password_con_token_valido(self, db_test):
+        """Un token válido debe cambiar la contraseña y quedar usado."""
+        db_test.crear_token_recuperacion(self.email, "token-valido")
+        
+        exito, _ = db_test.cambiar_password_con_token(self.email, "token-valido", "Nueva456!")
+        
+        assert exito is True
+        assert db_test.verificar_credenciales(self.email, "Nueva456!")[0] is True
+        # Un token sirve una sola vez
+        exito_reuso, _ = db_test.cambiar_password_con_token(self.email, "token-valido", "Otra789!")
+        assert exito_reuso is False
+    
+    def test_solo_el_ultimo_token_es_valido(self, db_test):
+        """Pedir un token nuevo debe anular los anteriores."""
+        db_test.crear_token_recuperacion(self.email, "token1")
+        db_test.crear_token_recuperacion(self.email, "token2")
+        
+        exito_viejo, mensaje = db_test.cambiar_password_con_token(self.email, "token1", "Nueva456!")
+        exito_nuevo, _ = db_test.cambiar_password_con_token(self.email, "token2", "Nueva456!")
+        
+        assert exito_viejo is False
+        assert "inválido" in mensaje
+        assert exito_nuevo is True
+    
+    def test_token_de_usuario_inexistente_no_se_gasta(self, db_test):
+        """Si no se cambia ninguna contraseña el token debe quedar sin usar."""
+        db_test.crear_token_recuperacion("huerfano@ejemplo.com", "token-huerfano")
+        
+        exito, mensaje = db_test.cambiar_password_con_token(
+            "huerfano@ejemplo.com", "token-huerfano", "Nueva456!"
+        )
+        usado = db_test._get_connection().execute(
+            "SELECT usado FROM recovery_tokens WHERE token = ?", ("token-huerfano",)
+        ).fetchone()[0]
+        
+        assert exito is False
+        assert "no encontrado" in mensaje.lower()
+        assert usado == 0
+    
+    def test_busqueda_de_token_usa_indice(self, db_test):
+        """La búsqueda del último token debe resolverse con idx_tokens_email."""
+        from src.database import _SQL_ULTIMO_TOKEN
+        conn = db_test._get_connection()
+        
+        plan = " ".join(
+            fila[-1] for fila in conn.execute("EXPLAIN QUERY PLAN " + _SQL_ULTIMO_TOKEN, (self.email,))
+        )
+        
+        assert "idx_tokens_email" in plan
 
 
 # ============================================================================
@@ -550,33 +879,32 @@ class TestRecoveryTokens:
 class TestPersistencia:
     """Pruebas de persistencia de datos."""
     
-    def test_datos_persisten_entre_conexiones(self):
+    def test_datos_persisten_entre_conexiones(self, tmp_path):
         """Datos deben persistir al cerrar y reabrir conexión."""
-        db_path = "data/test_persistencia.db"
+        db_path = str(tmp_path / "test_persistencia.db")
         
         # Primera conexión: crear usuario
-        db1 = Database(db_path)
+        db1 = Database(db_path, rondas_bcrypt=RONDAS_BCRYPT)
         db1.crear_usuario("persist@ejemplo.com", "Pass123!")
-        del db1  # Cerrar conexión
+        db1.close()  # Cierre explícito: no depende de cuándo actúe el GC
         
         # Segunda conexión: verificar que existe
-        db2 = Database(db_path)
+        db2 = Database(db_path, rondas_bcrypt=RONDAS_BCRYPT)
         usuario = db2.obtener_usuario("persist@ejemplo.com")
         
         assert usuario is not None
         assert usuario['email'] == "persist@ejemplo.com"
         
-        # Cleanup
-        Path(db_path).unlink(missing_ok=True)
+        # Cleanup: pytest elimina el directorio temporal
+        db2.close()
     
     def test_multiples_operaciones_consecutivas(self, db_test):
         """Debe manejar múltiples operaciones seguidas."""
         emails = [f"user{i}@test.com" for i in range(10)]
         
-        # Crear 10 usuarios
-        for email in emails:
-            exito, _ = db_test.crear_usuario(email, "Pass123!")
-            assert exito is True
+        # Crear 10 usuarios en una sola transacción
+        exito, _ = db_test.crear_usuarios((email, "Pass123!") for email in emails)
+        assert exito is True
         
         # Verificar que todos existen
         for email in emails:
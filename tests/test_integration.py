@@ -3,27 +3,12 @@ Pruebas de integración del sistema de autenticación.
 Verifica flujos completos de usuario y la interacción entre componentes.
 """
 import pytest
-import sys
-from pathlib import Path
-
-# Agregar el directorio raíz al path
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
-from src.database import Database
-from src.auth_service import AuthService
 
 
 @pytest.fixture
-def sistema_completo():
-    """Fixture que crea un sistema completo (BD + Servicio)."""
-    db_path = "data/test_integration.db"
-    db = Database(db_path)
-    auth_service = AuthService(db)
-    
-    yield {"db": db, "auth": auth_service}
-    
-    # Cleanup
-    Path(db_path).unlink(missing_ok=True)
+def sistema_completo(db_test, auth_service):
+    """Fixture que entrega el sistema completo con la BD limpia en cada test."""
+    return {"db": db_test, "auth": auth_service}
 
 
 # ============================================================================
@@ -200,11 +185,16 @@ class TestFlujoRecuperacionPassword:
         exito_solicitud, msg_solicitud = auth.solicitar_recuperacion_password(email)
         assert exito_solicitud is True
         assert "token" in msg_solicitud.lower()
+        token = msg_solicitud.rsplit(": ", 1)[1]
         
-        # 3. Cambiar contraseña
-        exito_cambio, msg_cambio = auth.cambiar_password(email, password_nueva)
+        # 3. Cambiar contraseña con el token recibido
+        exito_cambio, msg_cambio = auth.cambiar_password(email, token, password_nueva)
         assert exito_cambio is True
         
+        # El token ya no sirve para un segundo cambio
+        exito_reuso, _ = auth.cambiar_password(email, token, "Otra789!")
+        assert exito_reuso is False
+        
         # 4. Verificar que la antigua no funciona
         exito_antigua, _ = auth.iniciar_sesion(email, password_original)
         assert exito_antigua is False
@@ -213,7 +203,7 @@ class TestFlujoRecuperacionPassword:
         exito_nueva, _ = auth.iniciar_sesion(email, password_nueva)
         assert exito_nueva is True
     
-    def test_flujo_recuperacion_desbloquea_usuario(self, sistema_completo):
+    def test_flujo_recuperacion_desbloquea_usuario(self, sistema_completo, emitir_token):
         """Recuperación de password desbloquea usuario bloqueado."""
         auth = sistema_completo["auth"]
         
@@ -223,14 +213,13 @@ class TestFlujoRecuperacionPassword:
         
         # Registro y bloqueo
         auth.registrar_usuario(email, password_original)
-        for i in range(5):
-            auth.iniciar_sesion(email, f"Wrong{i}!")
+        sistema_completo["db"].bloquear_usuario(email)
         
         assert auth.usuario_esta_bloqueado(email) is True
         
         # Recuperación
-        auth.solicitar_recuperacion_password(email)
-        auth.cambiar_password(email, password_nueva)
+        token = emitir_token(email)
+        auth.cambiar_password(email, token, password_nueva)
         
         # Verificar desbloqueo
         assert auth.usuario_esta_bloqueado(email) is False
@@ -313,8 +302,7 @@ class TestIntegracionBaseDatosServicio:
         auth.iniciar_sesion(email, "Wrong!")
         
         # Verificar en BD
-        usuario_bd = db.obtener_usuario(email)
-        assert usuario_bd['intentos_fallidos'] == 1
+        assert db.obtener_estado_usuario(email).intentos_fallidos == 1
     
     def test_bloqueo_sincronizado(self, sistema_completo):
         """Estado de bloqueo debe estar sincronizado."""
@@ -343,7 +331,7 @@ class TestIntegracionBaseDatosServicio:
 class TestConsistenciaEstado:
     """Pruebas de consistencia del estado del sistema."""
     
-    def test_estado_consistente_despues_operaciones_mixtas(self, sistema_completo):
+    def test_estado_consistente_despues_operaciones_mixtas(self, sistema_completo, emitir_token):
         """Estado debe ser consistente tras operaciones variadas."""
         auth = sistema_completo["auth"]
         
@@ -353,7 +341,7 @@ class TestConsistenciaEstado:
         # Mezcla de operaciones
         auth.iniciar_sesion(email, "Pass1!")  # Exitoso
         auth.iniciar_sesion(email, "Wrong!")  # Fallido
-        auth.cambiar_password(email, "Pass2!")  # Cambio
+        auth.cambiar_password(email, emitir_token(email), "Pass2!")  # Cambio
         auth.iniciar_sesion(email, "Pass2!")  # Exitoso con nueva
         
         # Verificar estado final
@@ -377,11 +365,11 @@ class TestConsistenciaEstado:
         auth = sistema_completo["auth"]
         
         # Simular múltiples usuarios operando
-        for i in range(10):
-            email = f"concurrent{i}@test.com"
-            password = f"Pass{i}!"
-            
-            auth.registrar_usuario(email, password)
+        usuarios = [(f"concurrent{i}@test.com", f"Pass{i}!") for i in range(10)]
+        exito, _ = auth.registrar_usuarios(usuarios)
+        assert exito is True
+        
+        for email, password in usuarios:
             exito, _ = auth.iniciar_sesion(email, password)
             assert exito is True
 
@@ -393,7 +381,7 @@ class TestConsistenciaEstado:
 class TestEscenariosReales:
     """Pruebas basadas en escenarios de uso real."""
     
-    def test_escenario_usuario_olvida_password(self, sistema_completo):
+    def test_escenario_usuario_olvida_password(self, sistema_completo, emitir_token):
         """Escenario: Usuario olvida su contraseña."""
         auth = sistema_completo["auth"]
         
@@ -410,12 +398,11 @@ class TestEscenariosReales:
         auth.iniciar_sesion(email, "Intento3!")
         
         # Usuario solicita recuperación
-        exito_rec, _ = auth.solicitar_recuperacion_password(email)
-        assert exito_rec is True
+        token = emitir_token(email)
         
         # Usuario cambia password
         password_nueva = "Nueva456!"
-        auth.cambiar_password(email, password_nueva)
+        auth.cambiar_password(email, token, password_nueva)
         
         # Usuario puede hacer login con la nueva
         exito_final, _ = auth.iniciar_sesion(email, password_nueva)
@@ -448,7 +435,7 @@ class TestEscenariosReales:
         assert exito_real is False
         assert "bloqueado" in msg.lower()
     
-    def test_escenario_usuario_cambia_password_periodicamente(self, sistema_completo):
+    def test_escenario_usuario_cambia_password_periodicamente(self, sistema_completo, emitir_token):
         """Escenario: Usuario cambia password por seguridad."""
         auth = sistema_completo["auth"]
         
@@ -465,7 +452,8 @@ class TestEscenariosReales:
             assert exito is True
             
             # Cambiar a siguiente
-            auth.cambiar_password(email, passwords[i + 1])
+            token = emitir_token(email)
+            auth.cambiar_password(email, token, passwords[i + 1])
             
             # Verificar que la anterior no funciona
             exito_antigua, _ = auth.iniciar_sesion(email, passwords[i])
@@ -569,19 +557,20 @@ class TestLimitesSistema:
         
         cantidad_usuarios = 100
         
-        # Crear muchos usuarios
-        for i in range(cantidad_usuarios):
-            email = f"user{i}@test.com"
-            password = f"Pass{i}!"
-            exito, _ = auth.registrar_usuario(email, password)
-            assert exito is True
+        # Los datos se arman una sola vez y sirven para registrar y verificar
+        emails = [f"user{i}@test.com" for i in range(cantidad_usuarios)]
+        passwords = [f"Pass{i}!" for i in range(cantidad_usuarios)]
         
-        # Verificar que todos pueden hacer login
-        for i in range(0, cantidad_usuarios, 10):  # Probar algunos
-            email = f"user{i}@test.com"
-            password = f"Pass{i}!"
-            exito, _ = auth.iniciar_sesion(email, password)
-            assert exito is True
+        # Crear muchos usuarios (una sola transacción)
+        exito, _ = auth.registrar_usuarios(zip(emails, passwords))
+        assert exito is True
+        
+        # Verificar que todos quedaron registrados (una sola consulta)
+        assert sistema_completo["db"].usuarios_existen(emails) == set(emails)
+        
+        # Un login de extremo a extremo como muestra representativa
+        exito, _ = auth.iniciar_sesion("user99@test.com", "Pass99!")
+        assert exito is True
     
     def test_sistema_maneja_muchos_intentos_fallidos(self, sistema_completo):
         """Sistema debe manejar muchos intentos sin degradación."""